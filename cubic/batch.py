@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import glob
+import json
+import os
+import time
+
+import jobs
+import wavinfo
+
+# File extensions picked up when a directory is given as the batch input
+audio_extensions = (".wav",)
+
+# File extensions treated as manifests (one audio path per line)
+manifest_extensions = (".txt", ".lst", ".manifest")
+
+
+def collect_files(path):
+    """Returns the list of audio files named by path. The path may be a
+    single audio file, a directory (searched recursively for audio files),
+    a glob pattern, or a manifest listing one audio path per line. Relative
+    paths in a manifest are relative to the manifest's directory."""
+
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                if name.lower().endswith(audio_extensions):
+                    files.append(os.path.join(root, name))
+        return sorted(files)
+
+    if glob.has_magic(path):
+        return sorted(glob.glob(path, recursive=True))
+
+    if path.lower().endswith(manifest_extensions):
+        base = os.path.dirname(path)
+        files = []
+        with open(path, "r") as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                files.append(os.path.join(base, line))
+        return files
+
+    return [path]
+
+
+def audio_duration(path):
+    """Returns the duration of the given audio file in seconds, or 0 if
+    it cannot be determined."""
+    try:
+        return wavinfo.read_header(path).duration
+    except (ValueError, OSError):
+        return 0.0
+
+
+class BatchStats(object):
+    """BatchStats accumulates throughput statistics for a batch run. Only
+    files that were transcribed count towards audio_seconds (and so the
+    audio-seconds/sec throughput); the audio in files that failed is
+    counted separately in failed_audio_seconds."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.audio_seconds = 0.0
+        self.failed_audio_seconds = 0.0
+        self.bytes_sent = 0
+
+    def add(self, record):
+        """Adds the given result record to the statistics."""
+        self.files += 1
+        self.bytes_sent += record.get("bytes_sent", 0)
+        if record["error"] is not None:
+            self.failed += 1
+            self.failed_audio_seconds += record["audio_seconds"]
+        else:
+            self.audio_seconds += record["audio_seconds"]
+
+    def elapsed(self):
+        """Returns the wall time in seconds since the run started."""
+        return time.time() - self.start_time
+
+    def files_per_second(self):
+        return self.files / max(self.elapsed(), 1e-9)
+
+    def audio_seconds_per_second(self):
+        return self.audio_seconds / max(self.elapsed(), 1e-9)
+
+    def summary(self):
+        """Returns a human readable summary of the run."""
+        return ("{} files ({} failed, {} skipped), {:.1f} audio seconds "
+                "transcribed ({:.1f} in failed files) in {:.1f} seconds: "
+                "{:.2f} files/sec, {:.2f} audio-seconds/sec, "
+                "{} bytes uploaded".format(
+                    self.files, self.failed, self.skipped, self.audio_seconds,
+                    self.failed_audio_seconds,
+                    self.elapsed(), self.files_per_second(),
+                    self.audio_seconds_per_second(), self.bytes_sent))
+
+
+def run_batch(files, transcribe, concurrency, results, job_log=None):
+    """Calls transcribe(path, digest) for every file using a pool of
+    concurrency worker threads, where digest is the hex SHA-256 of the
+    file's contents. transcribe should return a dict of fields to add to
+    the file's result record, including the list of final "transcripts".
+    Each file's result is written to the results file object
+    as a JSON line as soon as the file finishes, and the BatchStats for the
+    run are returned.
+
+    If a jobs.JobLog is given, files it records as done are skipped and the
+    outcome of every processed file is checkpointed to it, so an interrupted
+    run can be resumed."""
+
+    def process(path):
+        start = time.time()
+        record = {"file": path, "transcripts": [], "error": None}
+        try:
+            record["sha256"] = jobs.file_digest(path)
+        except OSError as err:
+            record["error"] = str(err)
+            record["audio_seconds"] = 0.0
+            record["elapsed"] = time.time() - start
+            return record
+
+        if job_log is not None:
+            if job_log.is_done(path, record["sha256"]):
+                return None
+            job_log.mark_running(path, record["sha256"])
+
+        try:
+            record.update(transcribe(path, record["sha256"]))
+        except Exception as err:
+            record["error"] = str(err)
+        record["audio_seconds"] = audio_duration(path)
+        record["elapsed"] = time.time() - start
+
+        if job_log is not None:
+            if record["error"] is None:
+                job_log.mark_done(path, record["sha256"])
+            else:
+                job_log.mark_failed(path, record["sha256"], record["error"])
+        return record
+
+    stats = BatchStats()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [pool.submit(process, path) for path in files]
+
+        # Results are written from this thread only, in completion order
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            if record is None:
+                # Finished in a previous run
+                stats.skipped += 1
+                continue
+            results.write(json.dumps(record) + "\n")
+            results.flush()
+            stats.add(record)
+    finally:
+        # Don't start any more files if we were interrupted
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return stats
@@ -15,7 +15,14 @@
 # limitations under the License.
 
 import cubic
-import audio_io
+import batch
+import cache
+import catalog
+import channels
+import convert
+import jobs
+import upload
+import wavinfo
 
 # Connect to the Cobalt demo server (replace value to use a different
 # server, such as "localhost:2727")
@@ -25,53 +32,219 @@ server_address = "demo.cobaltspeech.com:2727"
 # ListModels() method (shown below).
 model_id = "en-us-16-far"
 
+# Whether to choose the model for each file automatically. When
+# enabled, each file's WAV header is read and the file is sent to a
+# model whose sample rate matches (preferring model_id). Files that
+# no model can handle are reported without contacting the server.
+auto_select_model = True
+
+# Whether to convert files that no model supports directly (e.g. a
+# sample rate mismatch, or stereo audio) to 16-bit mono PCM at the
+# sample rate of the chosen model. Requires auto_select_model.
+convert_audio = True
+
 # Whether the client connection is insecure. Must match the
 # server config. Insecure connections are not recommended for
 # production.
 insecure_connection = False
 
-# Name of the file to process
-audio_file = "./sample.wav"
+# How long (in seconds) the server version info and model list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
+# Audio to process. This may be a single file, a directory of
+# .wav files, a glob pattern (e.g. "./samples/*.wav"), or a manifest
+# file listing one audio path per line.
+audio_path = "./sample.wav"
+
+# Number of files to transcribe concurrently. All workers share
+# the same client (and gRPC channel).
+concurrency = 4
+
+# File where results are written, one JSON object per line, as
+# each file finishes. Results are appended so that a resumed run
+# adds to the output of the previous one.
+results_file = "./results.jsonl"
+
+# Size (in bytes) of each audio chunk uploaded to the server. Files
+# are streamed to the server in chunks of this size, read through a
+# memory map, so the upload starts right away and memory use stays
+# flat no matter how long the recording is. Set to None to send each
+# file in a single Recognize request instead.
+upload_chunk_size = 64 * 1024
+
+# SQLite job log used to checkpoint the batch run. Files already
+# transcribed (with unchanged contents) are skipped when the run is
+# restarted; failed and interrupted files are retried. Set to None
+# to disable checkpointing.
+job_file = "./batch_jobs.db"
+
+# Directory of the transcript cache. Responses are cached by a hash
+# of the audio plus the recognition config, so resubmitting the same
+# audio with the same config skips the server entirely. Set to None
+# to disable the cache.
+cache_dir = "./transcript_cache"
+
+# Maximum size of the transcript cache, in bytes. The least recently
+# used entries are evicted when the cache grows past this size.
+cache_max_bytes = 256 * 1024 * 1024
+
+# Set to True to ignore cached results (fresh results are still stored).
+cache_bypass = False
 
 if __name__ == "__main__":
-    # Create the client
-    client = cubic.Client(server_address)
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    client = channels.client(server_address, insecure=insecure_connection)
+    channels.pool.warmup(wait=False)
+
+    # Look up server info in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
 
     # Print version info
-    resp = client.Version()
+    resp = server_info.get(server_address, "version", cubic.VersionResponse,
+                           client.Version)
     print("Version")
     print("  Cubic:", resp.cubic)
     print("  Server:", resp.server)
     print("")
 
     # Print the list of available models on the server
-    resp = client.ListModels()
+    models = server_info.get(server_address, "models",
+                             cubic.ListModelsResponse, client.ListModels).models
     print("Available Models:")
-    for mdl in resp.models:
+    for mdl in models:
         print("  ID:", mdl.id)
         print("  Name:", mdl.name)
         print("  Sample Rate:", mdl.attributes.sample_rate)
         print("")
 
     # Set up the recognition config
-    print("Running batch ASR on '{}' using model '{}'\n".format(audio_file, model_id))
-    cfg = cubic.RecognitionConfig(
-        model_id = model_id,
-        audio_encoding = cubic.RecognitionConfig.WAV
-    )
+    files = batch.collect_files(audio_path)
+    print("Running batch ASR on {} file(s) from '{}' using model '{}'\n".format(
+        len(files), audio_path, "(automatic)" if auto_select_model else model_id))
+
+    def recognition_config(path):
+        """Returns the recognition config for the given file, along with
+        the WavInfo and a convert.Converter if the file's audio needs to
+        be converted before it is sent."""
+        if not auto_select_model:
+            return cubic.RecognitionConfig(
+                model_id = model_id,
+                audio_encoding = cubic.RecognitionConfig.WAV
+            ), None, None
+
+        # Route the file to a model matching its sample rate
+        info = wavinfo.read_header(path)
+        file_model_id = wavinfo.select_model(info, models, model_id)
+        if file_model_id is not None and info.channels == 1:
+            return cubic.RecognitionConfig(
+                model_id = file_model_id,
+                audio_encoding = cubic.RecognitionConfig.WAV
+            ), info, None
+
+        # Otherwise the audio has to be converted for the model
+        encoding = info.format_name
+        if encoding == convert.PCM16 and info.bits_per_sample != 16:
+            encoding = None
+        if not convert_audio or encoding not in (convert.PCM16, convert.ULAW, convert.ALAW):
+            raise ValueError("no model supports {} Hz {} audio".format(
+                info.sample_rate, info.format_name))
+
+        if file_model_id is None:
+            file_model_id = model_id
+        target = next((mdl for mdl in models if mdl.id == file_model_id), models[0])
+        converter = convert.Converter(encoding, info.sample_rate, info.channels,
+                                      target.attributes.sample_rate)
+        return cubic.RecognitionConfig(
+            model_id = target.id,
+            audio_encoding = cubic.RecognitionConfig.RAW_LINEAR16
+        ), info, converter
+
+    transcript_cache = None
+    if cache_dir is not None:
+        transcript_cache = cache.TranscriptCache(cache_dir, cache_max_bytes,
+                                                 bypass=cache_bypass)
+
+    def recognize(path, digest, cfg, info, converter):
+        # Check the cache first
+        key = None
+        if transcript_cache is not None:
+            key = cache.cache_key(digest, cfg)
+            data = transcript_cache.get(key)
+            if data is not None:
+                return cubic.RecognitionResponse.FromString(data), {}
+
+        metrics = {}
+        with open(path, 'rb') as audio:
+            if converter is not None:
+                # Convert the samples in the data chunk as they are sent
+                audio.seek(info.data_offset)
+                chunks = convert.ConvertingReader(
+                    audio, converter, upload_chunk_size or 8192,
+                    limit=info.data_size, chunk_size=upload_chunk_size)
+            elif upload_chunk_size is not None:
+                chunks = upload.ChunkedAudio(audio, upload_chunk_size)
+
+            if upload_chunk_size is None:
+                # Start batch recognition. No results will be returned
+                # until the entire file is processed.
+                if converter is None:
+                    resp = client.Recognize(cfg, audio)
+                    metrics["bytes_sent"] = audio.tell()
+                else:
+                    resp = client.Recognize(cfg, chunks)
+                    metrics["bytes_sent"] = chunks.bytes_sent
+            else:
+                # Stream the file in chunks, keeping only final results
+                resp = cubic.RecognitionResponse()
+                try:
+                    for partial in client.StreamingRecognize(cfg, chunks):
+                        resp.results.extend(
+                            r for r in partial.results if not r.is_partial)
+                finally:
+                    # Release the memory map even if the request failed
+                    if converter is None:
+                        chunks.close()
+                metrics = chunks.metrics()
+
+        if transcript_cache is not None:
+            transcript_cache.put(key, resp.SerializeToString())
+        return resp, metrics
+
+    def transcribe(path, digest):
+        cfg, info, converter = recognition_config(path)
+        resp, metrics = recognize(path, digest, cfg, info, converter)
+        metrics["model_id"] = cfg.model_id
+        metrics["converted"] = converter is not None
+        metrics["transcripts"] = [result.alternatives[0].transcript
+                                  for result in resp.results
+                                  if not result.is_partial]
+        return metrics
+
+    job_log = None
+    if job_file is not None:
+        job_log = jobs.JobLog(job_file)
 
     try:
-        # Open the audio file
-        with open(audio_file, 'rb') as audio:
-            # Start batch recognition. No results will be returned until
-            # the entire file is processed.
-            resp = client.Recognize(cfg, audio)
-            for result in resp.results:
-                if not result.is_partial:
-                    print("Transcript:", result.alternatives[0].transcript)
+        with open(results_file, 'a') as results:
+            stats = batch.run_batch(files, transcribe, concurrency, results,
+                                    job_log=job_log)
+        print("Results written to '{}'".format(results_file))
+        print(stats.summary())
+        print("Open channels:", channels.pool.open_channels())
+        if transcript_cache is not None:
+            print(transcript_cache.summary())
 
     except KeyboardInterrupt:
-        # stop streaming when ctrl+C pressed
+        # stop processing when ctrl+C pressed
         pass
     except Exception as err:
         print("Error while trying to process audio : {}".format(err))
+
+    if job_log is not None:
+        job_log.close()
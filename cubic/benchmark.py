@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import concurrent.futures
+import json
+import time
+
+import grpc
+import cubic
+from cubic.cubic_pb2_grpc import CubicServicer, add_CubicServicer_to_server
+
+import channels
+import wavinfo
+
+# Server to benchmark. If None, a local stand-in server is started so
+# that only the client-side overhead is measured (e.g. in CI).
+server_address = None
+
+# Whether the client connection is insecure. Must match the
+# server config. The local stand-in server is always insecure.
+insecure_connection = False
+
+# ASR model to use
+model_id = "en-us-16-far"
+
+# WAV files replayed by the benchmark. Streams cycle through them.
+audio_files = ["./sample.wav", "./samples/Agent.wav", "./samples/Client.wav"]
+
+# Number of concurrent streams
+streams = 8
+
+# Playback speed relative to real time. 1.0 streams audio as a live
+# microphone would; 0 sends it as fast as possible.
+speed = 1.0
+
+# Duration of each audio chunk sent, in milliseconds
+chunk_ms = 20
+
+# The stand-in server returns a partial result after this many chunks
+partial_every = 10
+
+# File the report is written to as JSON (None to skip)
+report_file = "./benchmark.json"
+
+
+class StandInServicer(CubicServicer):
+    """StandInServicer is a minimal Cubic server used to benchmark the
+    client without a real ASR engine. It returns a partial result every
+    partial_every audio messages and a final result when the stream ends.
+    The transcript of each result is the number of audio bytes received
+    when it was produced, which lets the client match a result to the
+    chunk that triggered it."""
+
+    def StreamingRecognize(self, request_iterator, context):
+        received = 0
+        messages = 0
+        for request in request_iterator:
+            if request.HasField("config"):
+                continue
+            received += len(request.audio.data)
+            messages += 1
+            if messages % partial_every == 0:
+                yield self._response(received, True)
+        yield self._response(received, False)
+
+    def _response(self, received, is_partial):
+        alt = cubic.RecognitionAlternative(transcript=str(received))
+        result = cubic.RecognitionResult(alternatives=[alt],
+                                         is_partial=is_partial)
+        return cubic.RecognitionResponse(results=[result])
+
+
+def start_stand_in_server():
+    """Starts the stand-in server on a free local port and returns the
+    server and its address."""
+    server = grpc.server(concurrent.futures.ThreadPoolExecutor(
+        max_workers=streams + 4))
+    add_CubicServicer_to_server(StandInServicer(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return server, "localhost:{}".format(port)
+
+
+def load_audio(path):
+    """Returns the contents of the given WAV file and its WavInfo."""
+    info = wavinfo.read_header(path)
+    with open(path, "rb") as f:
+        return f.read(), info
+
+
+class PacedReader(object):
+    """PacedReader replays audio data in fixed-duration chunks, sleeping
+    between chunks to simulate a live source at the given speed. It
+    records the time each chunk was handed to gRPC."""
+
+    def __init__(self, data, info):
+        bytes_per_second = info.sample_rate * info.block_align
+        self.chunk_bytes = max(info.block_align,
+                               bytes_per_second * chunk_ms // 1000)
+        self.chunk_seconds = self.chunk_bytes / float(bytes_per_second)
+        self.data = memoryview(data)
+        self.pos = 0
+        self.offsets = []
+        self.times = []
+
+    def read(self, size=-1):
+        if self.pos >= len(self.data):
+            return b""
+
+        if speed > 0 and self.times:
+            # Wait until this chunk would be available from a live source
+            due = self.times[0] + len(self.times) * self.chunk_seconds / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        chunk = self.data[self.pos:self.pos + self.chunk_bytes].tobytes()
+        self.pos += len(chunk)
+        self.offsets.append(self.pos)
+        self.times.append(time.monotonic())
+        return chunk
+
+    def sent_time(self, offset):
+        """Returns the time the chunk containing the given byte offset
+        was sent."""
+        i = bisect.bisect_left(self.offsets, offset)
+        return self.times[min(i, len(self.times) - 1)]
+
+
+def run_stream(client, path):
+    """Streams the given file and returns its latency measurements."""
+    data, info = load_audio(path)
+    reader = PacedReader(data, info)
+    cfg = cubic.RecognitionConfig(
+        model_id = model_id,
+        audio_encoding = cubic.RecognitionConfig.WAV
+    )
+
+    partial = []
+    final = []
+    for resp in client.StreamingRecognize(cfg, reader):
+        now = time.monotonic()
+        for result in resp.results:
+            if result.is_partial:
+                # The stand-in server reports how much audio it had seen
+                offset = int(result.alternatives[0].transcript or 0)
+                partial.append(now - reader.sent_time(offset))
+            else:
+                # Latency from the end of the utterance (last chunk sent)
+                final.append(now - reader.times[-1])
+    end = time.monotonic()
+
+    audio_seconds = info.duration
+    return {
+        "file": path,
+        "partial": partial,
+        "final": final,
+        "rtf": (end - reader.times[0]) / audio_seconds if reader.times else 0.0,
+    }
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of the given values, interpolating
+    between the closest ranks."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    server = None
+    address = server_address
+    insecure = insecure_connection
+    if address is None:
+        server, address = start_stand_in_server()
+        insecure = True
+        print("Started stand-in server at", address)
+
+    client = channels.client(address, insecure=insecure)
+    print("Running {} stream(s) at {}x real time\n".format(
+        streams, speed if speed > 0 else "max"))
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=streams) as pool:
+        futures = [pool.submit(run_stream, client,
+                               audio_files[i % len(audio_files)])
+                   for i in range(streams)]
+        runs = [f.result() for f in futures]
+    elapsed = time.monotonic() - start
+
+    report = {
+        "streams": streams,
+        "speed": speed,
+        "elapsed": elapsed,
+        "partial_latency": summarize([v for r in runs for v in r["partial"]]),
+        "final_latency": summarize([v for r in runs for v in r["final"]]),
+        "rtf": summarize([r["rtf"] for r in runs]),
+    }
+
+    for name in ("partial_latency", "final_latency", "rtf"):
+        s = report[name]
+        unit = "" if name == "rtf" else " s"
+        print("{:16s} n={:<6d} p50={:.4f}{u} p95={:.4f}{u} p99={:.4f}{u} max={:.4f}{u}".format(
+            name, s["count"], s["p50"], s["p95"], s["p99"], s["max"], u=unit))
+
+    if report_file is not None:
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nReport written to '{}'".format(report_file))
+
+    if server is not None:
+        server.stop(None)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+
+def cache_key(audio_digest, config):
+    """Returns the cache key for audio with the given hex digest recognized
+    with the given cubic.RecognitionConfig. The config is serialized
+    deterministically so equal configs always produce the same key."""
+    h = hashlib.sha256()
+    h.update(audio_digest.encode("ascii"))
+    h.update(config.SerializeToString(deterministic=True))
+    return h.hexdigest()
+
+
+class TranscriptCache(object):
+    """TranscriptCache is an on-disk, size-bounded LRU cache of serialized
+    recognition responses. Each entry is stored in its own file named by
+    its key, and file modification times record recency so the LRU order
+    survives restarts. It is safe to use from multiple threads.
+
+    If bypass is True, lookups always miss (forcing a fresh Recognize
+    call) but new responses are still stored."""
+
+    def __init__(self, directory, max_bytes, bypass=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+
+        # Load existing entries, least recently used first
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Returns the cached data for the given key, or None on a miss."""
+        if self.bypass:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            # Removed from under us; treat it as a miss
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores data under the given key, evicting least recently used
+        entries as needed to stay within max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temporary file first so readers never see a
+        # partially written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        # Must be called with the lock held
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def total_bytes(self):
+        """Returns the number of bytes currently stored in the cache."""
+        with self._lock:
+            return self._total_bytes
+
+    def hit_ratio(self):
+        """Returns the fraction of lookups that were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        """Returns a human readable summary of the cache statistics."""
+        return "cache: {} hits, {} misses ({:.1%} hit ratio), {} evictions, {} bytes stored".format(
+            self.hits, self.misses, self.hit_ratio(), self.evictions,
+            self.total_bytes())
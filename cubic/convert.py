@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import time
+
+import numpy as np
+
+# Sample encodings understood by the Converter
+PCM16 = "pcm"
+ULAW = "ulaw"
+ALAW = "alaw"
+
+
+def _ulaw_table():
+    # G.711 mu-law expansion for all 256 code words
+    code = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = code & 0x80
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign != 0, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_table():
+    # G.711 A-law expansion for all 256 code words
+    code = np.arange(256, dtype=np.int32) ^ 0x55
+    sign = code & 0x80
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    magnitude = np.where(exponent == 0,
+                         (mantissa << 4) + 8,
+                         ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(sign != 0, magnitude, -magnitude).astype(np.int16)
+
+
+ulaw_table = _ulaw_table()
+alaw_table = _alaw_table()
+
+
+def decode(data, encoding):
+    """Decodes the given bytes to an array of 16-bit linear samples."""
+    if encoding == PCM16:
+        return np.frombuffer(data, dtype="<i2")
+    codes = np.frombuffer(data, dtype=np.uint8)
+    if encoding == ULAW:
+        return ulaw_table[codes]
+    if encoding == ALAW:
+        return alaw_table[codes]
+    raise ValueError("unsupported encoding: {}".format(encoding))
+
+
+def to_mono(samples, channels):
+    """Mixes interleaved samples with the given number of channels down
+    to a single channel."""
+    if channels == 1:
+        return samples
+    frames = samples[:len(samples) - len(samples) % channels]
+    return frames.reshape(-1, channels).mean(axis=1)
+
+
+def design_filter(up, down, zero_crossings=16, beta=8.0):
+    """Returns a Kaiser-windowed sinc lowpass filter for resampling by
+    up/down. The filter runs at the upsampled rate, with its cutoff at the
+    lower of the two Nyquist frequencies and a gain of up."""
+    factor = max(up, down)
+    length = 2 * zero_crossings * factor
+    length += -length % up
+    cutoff = 0.5 / factor
+
+    # Centre the filter on a whole sample, so that it delays the signal by
+    # exactly (length - 1) // 2 samples at the upsampled rate
+    center = (length - 1) // 2
+    half = max(center, length - 1 - center)
+    n = np.arange(length) - center
+    window = np.kaiser(2 * half + 1, beta)[half - center:half - center + length]
+    return 2 * cutoff * np.sinc(2 * cutoff * n) * window * up
+
+
+class Resampler(object):
+    """Resampler converts a stream of mono samples between sample rates
+    with a polyphase FIR filter. Chunks may be of any size; the filter
+    history and output phase are carried from one call to the next, so
+    the result is the same as resampling the whole stream at once. The
+    output is aligned with the input (the filter delay is compensated),
+    so the last half filter length of output is only produced by flush()
+    at the end of the stream."""
+
+    def __init__(self, from_rate, to_rate):
+        g = math.gcd(from_rate, to_rate)
+        self.up = to_rate // g
+        self.down = from_rate // g
+
+        # Split the filter into one set of taps per output phase. Taps
+        # are reversed so each output is a dot product with a window of
+        # consecutive input samples.
+        h = design_filter(self.up, self.down)
+        self.taps = len(h) // self.up
+        self._phases = h.reshape(self.taps, self.up).T[:, ::-1].copy()
+
+        # Computing output 0 at this position on the upsampled time line
+        # centres the filter on input sample 0
+        self._delay = (len(h) - 1) // 2
+        self.reset()
+
+    def reset(self):
+        """Discards the filter history, ready for a new stream."""
+        self._history = np.zeros(self.taps - 1)
+        self._t = self._delay
+        self._in = 0
+        self._out = 0
+
+    def process(self, samples):
+        """Resamples the given chunk of samples and returns the output
+        samples (as float64) that it completes."""
+        n = len(samples)
+        x = np.concatenate((self._history, samples))
+
+        # Output sample m sits at position t = m * down on the upsampled
+        # time line; it is computed from input sample t // up using the
+        # filter phase t % up.
+        t = np.arange(self._t, n * self.up, self.down)
+        out = np.empty(len(t))
+        if len(t):
+            windows = np.lib.stride_tricks.sliding_window_view(x, self.taps)
+            index = t // self.up
+            phase = t % self.up
+            for p in range(self.up):
+                sel = phase == p
+                out[sel] = windows[index[sel]] @ self._phases[p]
+            self._t = int(t[-1]) + self.down - n * self.up
+        else:
+            self._t -= n * self.up
+
+        if self.taps > 1:
+            self._history = x[len(x) - (self.taps - 1):]
+        self._in += n
+        self._out += len(out)
+        return out
+
+    def flush(self):
+        """Returns the output samples still held back by the filter delay
+        at the end of the stream, and resets the resampler so that it can
+        be used for a new stream."""
+        expected = -(-self._in * self.up // self.down)
+        out = self.process(np.zeros(self.taps))
+        out = out[:max(0, expected - (self._out - len(out)))]
+        self.reset()
+        return out
+
+
+class Converter(object):
+    """Converter turns a stream of audio bytes in the given encoding,
+    sample rate and channel count into 16-bit little-endian mono PCM at
+    to_rate. Input may be split at arbitrary byte boundaries."""
+
+    def __init__(self, encoding, from_rate, channels, to_rate):
+        self.encoding = encoding
+        self.channels = channels
+        self.frame_size = channels * (2 if encoding == PCM16 else 1)
+        self._pending = b""
+        self._resampler = None
+        if from_rate != to_rate:
+            self._resampler = Resampler(from_rate, to_rate)
+
+    def convert(self, data):
+        """Converts the given bytes and returns the converted bytes."""
+        if self._pending:
+            data = self._pending + data
+        usable = len(data) - len(data) % self.frame_size
+        self._pending = data[usable:]
+
+        samples = to_mono(decode(data[:usable], self.encoding), self.channels)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        return self._encode(samples)
+
+    def flush(self):
+        """Returns the converted audio still held by the resampler at the
+        end of the stream, and resets the Converter for a new stream. A
+        trailing partial frame is discarded."""
+        self._pending = b""
+        if self._resampler is None:
+            return b""
+        return self._encode(self._resampler.flush())
+
+    def input_size(self, output_bytes):
+        """Returns the number of input bytes (a whole number of frames)
+        that convert to at least output_bytes bytes."""
+        samples = -(-output_bytes // 2)
+        if self._resampler is not None:
+            samples = -(-samples * self._resampler.down // self._resampler.up)
+        return max(1, samples) * self.frame_size
+
+    def _encode(self, samples):
+        if samples.dtype != np.int16:
+            samples = np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+        return samples.astype("<i2", copy=False).tobytes()
+
+
+class ConvertingReader(object):
+    """ConvertingReader wraps an audio reader (anything with a read(size)
+    method returning bytes) and converts the audio it returns with the
+    given Converter. It may be passed to the Cubic client as audio. If
+    limit is given, at most that many bytes are read from the reader.
+
+    When the reader runs out, the audio held back by the converter is
+    flushed and returned before the end of the stream is reported. If the
+    reader returns more audio after that (e.g. a VADReader that has been
+    reset for the next utterance), it is converted as a new stream.
+
+    If chunk_size is given, the size argument passed to read() (e.g. by
+    the Cubic client) is ignored and the converted audio is returned in
+    chunks of chunk_size bytes, as with upload.ChunkedAudio. Upload
+    metrics are kept in the same way as ChunkedAudio."""
+
+    def __init__(self, reader, converter, bufsize=8192, limit=None,
+                 chunk_size=None):
+        self.reader = reader
+        self.converter = converter
+        self.bufsize = bufsize
+        self.remaining = limit
+        self.chunk_size = chunk_size
+        self._buf = bytearray()
+        self._flushed = False
+
+        # Upload metrics
+        self.start_time = time.time()
+        self.first_byte_time = None
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+
+    def read(self, size=-1):
+        """Reads and converts audio, returning size (or chunk_size) bytes
+        of converted audio (fewer at the end of the stream). Returns an
+        empty bytes object when the underlying reader is exhausted. If
+        size is negative, all of the remaining audio is converted."""
+        if self.chunk_size is not None:
+            size = self.chunk_size
+        while size < 0 or len(self._buf) < size:
+            if size < 0:
+                n = self.bufsize
+            else:
+                n = self.converter.input_size(size - len(self._buf))
+            if self.remaining is not None:
+                n = min(n, self.remaining)
+            data = self.reader.read(n) if n > 0 else b""
+            if not data:
+                if not self._flushed:
+                    self._buf += self.converter.flush()
+                    self._flushed = True
+                break
+            self._flushed = False
+            if self.remaining is not None:
+                self.remaining -= len(data)
+            self._buf += self.converter.convert(data)
+
+        if size < 0:
+            size = len(self._buf)
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        if out:
+            if self.first_byte_time is None:
+                self.first_byte_time = time.time()
+            self.bytes_sent += len(out)
+            self.chunks_sent += 1
+        return out
+
+    def time_to_first_byte(self):
+        """Returns the seconds from creation until the first chunk was
+        returned, or None if nothing has been sent."""
+        if self.first_byte_time is None:
+            return None
+        return self.first_byte_time - self.start_time
+
+    def metrics(self):
+        """Returns a dict of the upload metrics."""
+        return {
+            "bytes_sent": self.bytes_sent,
+            "chunks_sent": self.chunks_sent,
+            "time_to_first_byte": self.time_to_first_byte(),
+        }
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Job states recorded in the log
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def file_digest(path, bufsize=1 << 20):
+    """Returns the hex SHA-256 digest of the contents of the given file."""
+    digest = hashlib.sha256()
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if n == 0:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+class JobLog(object):
+    """JobLog records the progress of every file in a batch run in a
+    SQLite database, keyed by the file path and a hash of its contents.
+    When a run is restarted with the same log, files that already
+    finished are skipped, while files that failed or were still in
+    flight when the previous run stopped are processed again. A file
+    whose contents changed is treated as a new job."""
+
+    def __init__(self, path):
+        # The connection is shared by the batch worker threads, so
+        # access to it is serialized with a lock.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " path TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (path, digest))")
+
+    def close(self):
+        """Closes the underlying database."""
+        with self._lock:
+            self._db.close()
+
+    def status(self, path, digest):
+        """Returns the recorded status of the given job, or PENDING if
+        the job has not been seen before."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status FROM jobs WHERE path = ? AND digest = ?",
+                (path, digest)).fetchone()
+        return PENDING if row is None else row[0]
+
+    def is_done(self, path, digest):
+        """Returns True if the given job finished in a previous run."""
+        return self.status(path, digest) == DONE
+
+    def mark_running(self, path, digest):
+        """Records that processing of the given job has started."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (path, digest, status, attempts, updated)"
+                " VALUES (?, ?, ?, 1, ?)"
+                " ON CONFLICT (path, digest) DO UPDATE SET"
+                " status = excluded.status, attempts = attempts + 1,"
+                " error = NULL, updated = excluded.updated",
+                (path, digest, RUNNING, time.time()))
+
+    def mark_done(self, path, digest):
+        """Records that the given job finished successfully."""
+        self._finish(path, digest, DONE, None)
+
+    def mark_failed(self, path, digest, error):
+        """Records that the given job failed with the given error."""
+        self._finish(path, digest, FAILED, str(error))
+
+    def _finish(self, path, digest, status, error):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ?"
+                " WHERE path = ? AND digest = ?",
+                (status, error, time.time(), path, digest))
+
+    def counts(self):
+        """Returns a dict mapping each status to its number of jobs."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
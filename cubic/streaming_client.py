@@ -16,6 +16,10 @@
 
 import cubic
 import audio_io
+import catalog
+import channels
+import convert
+import vad
 
 
 # Connect to the Cobalt demo server (replace value to use a different
@@ -31,24 +35,71 @@ model_id = "en-us-16-far"
 # production.
 insecure_connection = False
 
+# How long (in seconds) the server version info and model list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
 # The external process responsible for recording audio
 record_cmd = "sox -q -d -c 1 -r 16000 -b 16 -L -e signed -t raw -"
 
+# Sample rate of the audio produced by record_cmd. If it differs from
+# the model's sample rate, the audio is resampled before it is sent.
+record_sample_rate = 16000
+
+# Duration (in milliseconds) of each chunk of recorded audio sent to
+# the server. Smaller frames lower latency at the cost of more requests.
+frame_ms = 20
+
+# Where recorded audio comes from: "process" runs record_cmd once and
+# keeps it running while recording, "sounddevice" records in-process
+# (requires the sounddevice package), and anything else is the path of
+# a raw audio file or FIFO to replay in real time (for headless testing).
+capture_source = "process"
+
+# Whether to run voice activity detection on the recorded audio. Only
+# speech (plus a little padding) is sent to the server, and the stream is
+# ended as soon as the speaker stops talking.
+use_vad = True
+
+# Frames quieter than this (in dBFS) are treated as silence
+vad_energy_threshold = -45.0
+
+# How long (in milliseconds) audio keeps being sent after speech stops
+vad_hangover_ms = 300
+
+# How long (in milliseconds) of silence ends the utterance
+vad_end_silence_ms = 800
+
+# How long (in milliseconds) of continuous speech starts an utterance, so
+# that clicks and coughs are ignored
+vad_min_speech_ms = 100
+
 if __name__ == "__main__":
-    # Create the client
-    client = cubic.Client(server_address)
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    client = channels.client(server_address, insecure=insecure_connection)
+    channels.pool.warmup(wait=False)
+
+    # Look up server info in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
 
     # Print version info
-    resp = client.Version()
+    resp = server_info.get(server_address, "version", cubic.VersionResponse,
+                           client.Version)
     print("Version")
     print("  Cubic:", resp.cubic)
     print("  Server:", resp.server)
     print("")
 
     # Print the list of available models on the server
-    resp = client.ListModels()
+    models = server_info.get(server_address, "models",
+                             cubic.ListModelsResponse, client.ListModels).models
     print("Available Models:")
-    for mdl in resp.models:
+    for mdl in models:
         print("  ID:", mdl.id)
         print("  Name:", mdl.name)
         print("  Sample Rate:", mdl.attributes.sample_rate)
@@ -60,18 +111,48 @@ if __name__ == "__main__":
         model_id = model_id
     )
 
-    # Set up the external recorder
-    recorder = audio_io.Recorder(cmd=record_cmd)
+    # Set up the recorder
+    backend = audio_io.capture_backend(capture_source, record_cmd,
+                                       sample_rate=record_sample_rate)
+    recorder = audio_io.Recorder(sample_rate=record_sample_rate,
+                                 frame_ms=frame_ms, backend=backend)
     recorder.start()
 
+    # Only send speech if voice activity detection is enabled
+    audio = recorder
+    if use_vad:
+        detector = vad.VAD(frame_ms=frame_ms,
+                           energy_threshold=vad_energy_threshold,
+                           hangover_ms=vad_hangover_ms,
+                           end_silence_ms=vad_end_silence_ms,
+                           min_speech_ms=vad_min_speech_ms)
+        gate = vad.VADReader(recorder, detector)
+        audio = gate
+
+    # Resample the recorded audio if the model expects a different rate
+    model_rate = next((mdl.attributes.sample_rate for mdl in models
+                       if mdl.id == model_id), record_sample_rate)
+    if model_rate != record_sample_rate:
+        print("Resampling audio from {} Hz to {} Hz".format(
+            record_sample_rate, model_rate))
+        converter = convert.Converter(convert.PCM16, record_sample_rate, 1,
+                                      model_rate)
+        audio = convert.ConvertingReader(audio, converter)
+
     try:
-        # Stream the audio using our recorder app
+        # Stream the audio using our recorder app. With voice activity
+        # detection, each utterance is sent on a new stream.
         print("\n(Recording. Ctrl+C to exit)")
-        for resp in client.StreamingRecognize(cfg, recorder):
-            for result in resp.results:
-                # This demo only cares about the final result
-                if not result.is_partial:
-                    print(result.alternatives[0].transcript)
+        while True:
+            for resp in client.StreamingRecognize(cfg, audio):
+                for result in resp.results:
+                    # This demo only cares about the final result
+                    if not result.is_partial:
+                        print(result.alternatives[0].transcript)
+
+            if not use_vad or gate.eof:
+                break
+            gate.reset()
 
     except KeyboardInterrupt:
         # stop streaming when ctrl+C pressed
@@ -79,4 +160,7 @@ if __name__ == "__main__":
     except Exception as err:
         print("Error while trying to stream audio : {}".format(err))
 
-    recorder.stop()
+    recorder.close()
+    if use_vad:
+        print("VAD dropped {} of {} frames".format(detector.dropped,
+                                                   detector.frames))
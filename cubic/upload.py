@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import mmap
+import time
+
+# Default number of bytes sent in each streaming request
+default_chunk_size = 64 * 1024
+
+# How often (in bytes) pages that were already sent are released back
+# to the OS when reading through a memory map.
+release_interval = 16 * 1024 * 1024
+
+
+class ChunkedAudio(object):
+    """ChunkedAudio feeds an audio file to a streaming Cubic request in
+    fixed-size chunks, so the upload starts immediately and the client's
+    memory use stays flat regardless of the length of the recording.
+
+    Regular files are read through a read-only memory map, and pages are
+    released once they have been sent. Pipes and other unseekable streams
+    are read into a single reusable buffer instead. The only per-chunk
+    copy is the bytes object handed to gRPC, which protobuf requires.
+
+    Objects of this class may be passed anywhere the Cubic client expects
+    an audio reader. The size argument passed to read() by the client is
+    ignored in favor of chunk_size."""
+
+    def __init__(self, f, chunk_size=default_chunk_size):
+        self.chunk_size = chunk_size
+        self._file = f
+        self._pos = 0
+        self._released = 0
+        self._mmap = None
+        self._buf = None
+        self.closed = False
+
+        try:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, ValueError, OSError):
+            # Not a regular (non-empty) file; fall back to buffered reads
+            self._buf = bytearray(chunk_size)
+            self._view = memoryview(self._buf)
+
+        # Upload metrics
+        self.start_time = time.time()
+        self.first_byte_time = None
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+
+    def read(self, size=-1):
+        """Returns the next chunk of audio, or an empty bytes object at
+        the end of the file. Raises a ValueError if the ChunkedAudio has
+        been closed."""
+        if self.closed:
+            raise ValueError("read from a closed ChunkedAudio")
+        if self._mmap is not None:
+            chunk = self._mmap[self._pos:self._pos + self.chunk_size]
+            self._pos += len(chunk)
+            self._release()
+        else:
+            n = self._file.readinto(self._buf)
+            chunk = bytes(self._view[:n]) if n else b""
+
+        if chunk:
+            if self.first_byte_time is None:
+                self.first_byte_time = time.time()
+            self.bytes_sent += len(chunk)
+            self.chunks_sent += 1
+        return chunk
+
+    def _release(self):
+        # Tell the OS we won't need the pages we already sent, so that
+        # resident memory doesn't grow with the length of the file.
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        end = self._pos - self._pos % mmap.PAGESIZE
+        if end - self._released < release_interval:
+            return
+        self._mmap.madvise(mmap.MADV_DONTNEED, self._released,
+                           end - self._released)
+        self._released = end
+
+    def close(self):
+        """Releases the memory map, if any. The underlying file is not
+        closed. ChunkedAudio is also a context manager that closes itself
+        on exit."""
+        self.closed = True
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def time_to_first_byte(self):
+        """Returns the seconds from creation until the first chunk was
+        handed to gRPC, or None if nothing has been sent."""
+        if self.first_byte_time is None:
+            return None
+        return self.first_byte_time - self.start_time
+
+    def metrics(self):
+        """Returns a dict of the upload metrics."""
+        return {
+            "bytes_sent": self.bytes_sent,
+            "chunks_sent": self.chunks_sent,
+            "time_to_first_byte": self.time_to_first_byte(),
+        }
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import struct
+
+# WAVE format tags
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_ALAW = 0x0006
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+format_names = {
+    WAVE_FORMAT_PCM: "pcm",
+    WAVE_FORMAT_IEEE_FLOAT: "float",
+    WAVE_FORMAT_ALAW: "alaw",
+    WAVE_FORMAT_MULAW: "ulaw",
+}
+
+# Headers larger than this are not worth scanning for a data chunk
+max_header_size = 1 << 20
+
+
+class WavInfo(collections.namedtuple("WavInfo", [
+        "format_tag", "channels", "sample_rate", "block_align",
+        "bits_per_sample", "data_offset", "data_size"])):
+    """WavInfo describes the audio format and data layout of a WAV file."""
+
+    __slots__ = ()
+
+    @property
+    def format_name(self):
+        """Returns a short name for the sample format (e.g., "pcm")."""
+        return format_names.get(self.format_tag, hex(self.format_tag))
+
+    @property
+    def frames(self):
+        """Returns the number of sample frames in the data chunk."""
+        if self.block_align == 0:
+            return 0
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self):
+        """Returns the duration of the audio in seconds."""
+        if self.sample_rate == 0:
+            return 0.0
+        return self.frames / float(self.sample_rate)
+
+
+def read_header(path):
+    """Parses the RIFF/WAVE header of the given file and returns a WavInfo.
+    Only the header chunks are read; the samples are never decoded. Raises
+    ValueError if the file is not a WAV file."""
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError("{}: not a RIFF/WAVE file".format(path))
+
+        fmt = None
+        while f.tell() < max_header_size:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                body = f.read(size)
+                if len(body) < 16:
+                    raise ValueError("{}: truncated fmt chunk".format(path))
+                fmt = struct.unpack("<HHIIHH", body[:16])
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # The real format tag is the first two bytes of the
+                    # SubFormat GUID.
+                    sub_format = struct.unpack("<H", body[24:26])[0]
+                    fmt = (sub_format,) + fmt[1:]
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("{}: data chunk before fmt chunk".format(path))
+                offset = f.tell()
+
+                # Streamed WAV files may not have a valid data size
+                available = file_size - offset
+                if size == 0 or size == 0xFFFFFFFF or size > available:
+                    size = available
+
+                format_tag, channels, sample_rate, _, block_align, bits = fmt
+                return WavInfo(format_tag, channels, sample_rate, block_align,
+                               bits, offset, size)
+
+            else:
+                # Skip the chunk, including its pad byte
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+        raise ValueError("{}: no data chunk found".format(path))
+
+
+def select_model(info, models, preferred_id=None):
+    """Returns the ID of a model (from the models listed by the Cubic
+    ListModels() method) whose sample rate matches the given WavInfo, or
+    None if there is no such model. preferred_id is chosen if it matches."""
+    matches = [mdl.id for mdl in models
+               if mdl.attributes.sample_rate == info.sample_rate]
+    if preferred_id in matches:
+        return preferred_id
+    if matches:
+        return matches[0]
+    return None
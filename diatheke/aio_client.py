@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import grpc
+import inspect
+import io
+import cobaltspeech.diatheke.v3.diatheke_pb2 as diatheke_pb2
+
+from cobaltspeech.diatheke.v3.diatheke_pb2_grpc import DiathekeServiceStub
+from aio_streams import AsyncASRStream, AsyncTranscribeStream
+import channels
+
+
+async def _read(reader, size):
+    # Readers may be regular file objects or have a coroutine read method.
+    # A blocking read stalls the event loop, so readers backed by a pipe
+    # or device should provide a coroutine instead.
+    data = reader.read(size)
+    if inspect.isawaitable(data):
+        data = await data
+    return data
+
+
+async def _write(writer, data):
+    # Writers may be regular file objects or have a coroutine write method
+    result = writer.write(data)
+    if inspect.isawaitable(result):
+        await result
+
+
+class AsyncSession(object):
+    """AsyncSession is an async context manager that creates a Diatheke
+    session on entry and deletes it on exit. Entering the context returns
+    the SessionOutput of the new session; the current token should be kept
+    up to date with update() so the right session is deleted."""
+
+    def __init__(self, client, model_id, **kwargs):
+        self._client = client
+        self._model_id = model_id
+        self._kwargs = kwargs
+        self.token = None
+
+    def update(self, session_output):
+        """Records the token of the given SessionOutput as the current
+        session token."""
+        self.token = session_output.token
+
+    async def __aenter__(self):
+        resp = await self._client.create_session(self._model_id, **self._kwargs)
+        self.update(resp.session_output)
+        return resp.session_output
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.token is not None:
+            await self._client.delete_session(self.token)
+
+
+class AsyncClient(object):
+    def __init__(self, server_address, insecure=False,
+                 server_certificate=None,
+                 client_certificate=None,
+                 client_key=None,
+                 options=None):
+        """  Creates a new asyncio Diatheke Client object. The methods mirror
+        those of client.Client, but are coroutines, so many sessions can be
+        served concurrently from a single thread. The client must be created
+        from within a running event loop.
+        Args:
+            server_address: host:port of where Diatheke server is running (string)
+            insecure: If set to true, an insecure grpc channel is used.
+                      Otherwise, a channel with transport security is used.
+            server_certificate:  PEM certificate as byte string which is used as a
+                                 root certificate that can validate the certificate
+                                 presented by the server we are connecting to.
+            client_certificate:  PEM certificate as bytes string presented by this Client when
+                                 connecting to a server. Use this when setting up mutually
+                                 authenticated TLS. The clientKey must also be provided.
+            client_key:  PEM key as byte string presented by this Client when
+                         connecting to a server. Use this when setting up mutually
+                         authenticated TLS. The clientCertificate must also be provided.
+            options:  gRPC channel options. Defaults to the keepalive and message
+                      size options of the shared channel pool.
+        """
+        self.server_address = server_address
+        self.insecure = insecure
+
+        if options is None:
+            options = channels.pool.options
+
+        if insecure:
+            # no transport layer security (TLS)
+            self._channel = grpc.aio.insecure_channel(server_address,
+                                                      options=options)
+        else:
+            # using a TLS endpoint with optional certificates for mutual authentication
+            if client_certificate is not None and client_key is None:
+                raise ValueError("client key must also be provided")
+            if client_key is not None and client_certificate is None:
+                raise ValueError("client certificate must also be provided")
+            creds = grpc.ssl_channel_credentials(
+                root_certificates=server_certificate,
+                private_key=client_key,
+                certificate_chain=client_certificate)
+            self._channel = grpc.aio.secure_channel(server_address, creds,
+                                                    options=options)
+
+        self._client = DiathekeServiceStub(self._channel)
+
+    async def close(self):
+        """ Closes and cleans up the client. """
+        await self._channel.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def version(self):
+        """Returns the version information of the connected server."""
+        return await self._client.Version(diatheke_pb2.VersionRequest())
+
+    async def list_models(self):
+        """Lists the models available to the Diatheke server, as specified in
+        the server's config file."""
+        resp = await self._client.ListModels(diatheke_pb2.ListModelsRequest())
+        return resp.models
+
+    async def create_session(self, model_id: str, wakeword: str = "",
+                             custom_metadata: str = "", storage_file_prefix: str = "",
+                             input_audio_format: diatheke_pb2.AudioFormat = None,
+                             output_audio_format: diatheke_pb2.AudioFormat = None):
+        """Creates a new session using the specified model ID and return
+        the session token and actions. The wakeword will only have an
+        effect if the model has wakeword detection enabled."""
+        metadata = diatheke_pb2.SessionMetadata(custom_metadata=custom_metadata,
+                                                storage_file_prefix=storage_file_prefix)
+
+        return await self._client.CreateSession(diatheke_pb2.CreateSessionRequest(
+            model_id=model_id, wakeword=wakeword, metadata=metadata,
+            input_audio_format=input_audio_format,
+            output_audio_format=output_audio_format))
+
+    def session(self, model_id: str, **kwargs):
+        """Returns an async context manager that creates a session on entry
+        and deletes it on exit. Keyword arguments are passed on to
+        create_session()."""
+        return AsyncSession(self, model_id, **kwargs)
+
+    async def delete_session(self, token):
+        """Cleans up the given token. Behavior is undefined if the given
+        token is used again after calling this function."""
+        await self._client.DeleteSession(
+            diatheke_pb2.DeleteSessionRequest(token_data=token))
+
+    async def process_text(self, token, text):
+        """Sends the given text to Diatheke and returns an updated session
+        token."""
+        req = diatheke_pb2.UpdateSessionRequest(session_input=diatheke_pb2.SessionInput(
+            token=token, text=diatheke_pb2.TextInput(text=text)))
+        return await self._client.UpdateSession(req)
+
+    async def process_asr_result(self, token, result):
+        """Sends the given ASR result to Diatheke and returns an updated
+        session token."""
+        req = diatheke_pb2.UpdateSessionRequest(
+            session_input=diatheke_pb2.SessionInput(token=token, asr=result))
+        return await self._client.UpdateSession(req)
+
+    async def process_command_result(self, token, cmd):
+        """Sends the given command result to Diatheke and returns an updated
+        session token. This function should be called in response to a command
+        action Diatheke sent previously."""
+        cmd = diatheke_pb2.CommandResult(id=cmd.id)
+        req = diatheke_pb2.UpdateSessionRequest(
+            session_input=diatheke_pb2.SessionInput(token=token, cmd=cmd))
+        return await self._client.UpdateSession(req)
+
+    async def set_story(self, token, story_id, params):
+        """Changes the current story for a Diatheke session. Returns an
+        updated session token."""
+        story = diatheke_pb2.SetStory(story_id=story_id, parameters=params)
+        req = diatheke_pb2.UpdateSessionRequest(
+            session_input=diatheke_pb2.SessionInput(token=token, story=story))
+        return await self._client.UpdateSession(req)
+
+    async def new_session_asr_stream(self, token):
+        """Creates a new stream to transcribe audio for the given
+        session token."""
+        # Create the ASR stream object and send the session token
+        stream = AsyncASRStream(client_stub=self._client)
+        await stream.send_token(token)
+        return stream
+
+    def new_tts_stream(self, token, reply):
+        """Creates a new stream to receive TTS audio from Diatheke based
+        on the given reply action. The returned call is an async iterator
+        of TTS responses."""
+        return self._client.StreamTTS(diatheke_pb2.StreamTTSRequest(
+            reply_action=reply, token=token))
+
+    async def tts_audio(self, token, reply):
+        """Async generator yielding the TTS audio for the given reply
+        action as it is received."""
+        async for data in self.new_tts_stream(token, reply):
+            yield data.audio
+
+    async def new_transcribe_stream(self, action):
+        """Creates a new stream for transcriptions usually in response to
+        a transcribe action in the session output. See
+        client.Client.new_transcribe_stream() for details."""
+        stream = AsyncTranscribeStream(client_stub=self._client)
+        await stream.send_action(action)
+        return stream
+
+    async def read_asr_audio(self, token, reader, buff_size):
+        """Convenience function to create an ASR stream and send audio
+        from the given reader to the stream. The reader's read method may
+        be a regular function or a coroutine. Returns the ASR result. Data
+        is sent in chunks defined by buff_size."""
+        # Check if we have a text or byte reader
+        is_text = isinstance(reader, io.TextIOBase)
+
+        stream = await self.new_session_asr_stream(token)
+        while True:
+            data = await _read(reader, buff_size)
+            if (is_text and data == '') or (not is_text and data == b''):
+                # Reached EOF
+                break
+
+            # Send the audio
+            if not await stream.send_audio(data):
+                break
+
+        return await stream.result()
+
+    async def read_asr_audio_with_partial(self, token, reader, result_handler, buff_size):
+        """Convenience function to create an ASR stream and send audio
+        from the given reader to the stream. Partial results are passed to
+        result_handler as they arrive, and the final ASR result is returned.
+        Data is sent in chunks defined by buff_size."""
+        # Check if we have a text or byte reader
+        is_text = isinstance(reader, io.TextIOBase)
+
+        call = self._client.StreamASRWithPartials()
+        await call.write(diatheke_pb2.StreamASRWithPartialsRequest(token=token))
+
+        # Send the audio in the background while reading results here
+        async def send_data():
+            while not call.done():
+                data = await _read(reader, buff_size)
+                if (is_text and data == '') or (not is_text and data == b''):
+                    # Reached EOF
+                    break
+                await call.write(diatheke_pb2.StreamASRWithPartialsRequest(audio=data))
+            if not call.done():
+                await call.done_writing()
+
+        sender = asyncio.ensure_future(send_data())
+        try:
+            async for result in call:
+                result_handler(result)
+
+                if result.asr_result.text != "":
+                    return result.asr_result
+        finally:
+            sender.cancel()
+            call.cancel()
+
+    async def write_tts_audio(self, token, reply_action, writer):
+        """Convenience function to create a TTS stream and send the audio
+        to the given writer. The writer's write method may be a regular
+        function or a coroutine. Returns when there is no more audio to
+        receive."""
+        # Check if we have a text or byte writer
+        is_text = isinstance(writer, io.TextIOBase)
+
+        async for audio in self.tts_audio(token, reply_action):
+            if is_text:
+                # Convert the text to a string before writing
+                await _write(writer, str(audio))
+            else:
+                await _write(writer, audio)
+
+    async def read_transcribe_audio(self, transcribe_action, reader, buff_size, callback):
+        """Convenience function to create a transcribe stream that reads
+        audio from the given reader in buff_size chunks. The provided
+        callback is called with transcribe results as they become
+        available. Returns when the streaming is complete."""
+        # Check if we have a text or byte reader
+        is_text = isinstance(reader, io.TextIOBase)
+
+        stream = await self.new_transcribe_stream(transcribe_action)
+
+        async def send_data():
+            while True:
+                data = await _read(reader, buff_size)
+                if (is_text and data == '') or (not is_text and data == b''):
+                    # Reached the EOF
+                    break
+                if not await stream.send_audio(data):
+                    return
+            await stream.send_finished()
+
+        sender = asyncio.ensure_future(send_data())
+        try:
+            async for result in stream:
+                callback(result)
+        finally:
+            sender.cancel()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from cobaltspeech.diatheke.v3.diatheke_pb2 import StreamASRRequest, TranscribeRequest
+import grpc
+
+
+class AsyncASRStream(object):
+    """AsyncASRStream is the asyncio counterpart of streams.ASRStream. It
+    represents a stream of audio data sent from the client to Diatheke for
+    speech recognition in the context of a session."""
+
+    def __init__(self, client_stub):
+        # Unlike the synchronous API, grpc.aio calls expose write() and
+        # done_writing() directly, so no helper thread or queue is needed.
+        self._call = client_stub.StreamASR()
+
+    async def _send(self, request):
+        # Check if the server has already returned a result
+        if self._call.done():
+            return False
+
+        await self._call.write(request)
+        return True
+
+    async def send_audio(self, audio_bytes):
+        """Send the given audio bytes to Diatheke for transcription.
+
+        If this function returns False, the server has closed the stream
+        and result() should be awaited to get the final ASR result."""
+        return await self._send(StreamASRRequest(audio=audio_bytes))
+
+    async def send_token(self, token):
+        """Send the given session token to Diatheke to update the
+        speech recognition context. The session token must first be
+        sent on the ASR stream before any audio will be recognized.
+        If the stream was created using client.new_session_asr_stream(),
+        the first token was already sent.
+
+        If this function returns False, the server has closed the stream
+        and result() should be awaited to get the final ASR result."""
+        return await self._send(StreamASRRequest(token=token))
+
+    async def result(self):
+        """Returns the result of speech recognition. This function may
+        be called to end the audio stream early, which will force a
+        transcription based on the audio received until this point, or
+        in response to receiving False from send_audio() or send_token()."""
+        if not self._call.done():
+            await self._call.done_writing()
+        return await self._call
+
+    def cancel(self):
+        """Cancels the stream without waiting for a result."""
+        self._call.cancel()
+
+
+class AsyncTranscribeStream(object):
+    """AsyncTranscribeStream is the asyncio counterpart of
+    streams.TranscribeStream. Audio is sent to Diatheke and transcriptions
+    are returned to the client. Results may be received with
+    receive_result() or by iterating over the stream with async for."""
+
+    def __init__(self, client_stub):
+        self._call = client_stub.Transcribe()
+
+    async def _send(self, request):
+        # Check if the stream has closed.
+        if self._call.done():
+            return False
+
+        await self._call.write(request)
+        return True
+
+    async def send_action(self, action):
+        """Send the given TranscribeAction to Diatheke to update the speech
+        recognition context. The action must first be sent on the stream
+        before any audio will be recognized. If the stream was created using
+        client.new_transcribe_stream(), this action was already sent.
+
+        If this function returns False, the server has closed the stream, and
+        no further attempts should be made to send an action or audio data to
+        the server."""
+        return await self._send(TranscribeRequest(action=action))
+
+    async def send_audio(self, audio_bytes):
+        """Send the given audio data to Diatheke for transcription.
+
+        If this function returns False, the server has closed the stream,
+        and no further attempts should be made to send an action or audio
+        data to the server."""
+        return await self._send(TranscribeRequest(audio=audio_bytes))
+
+    async def send_finished(self):
+        """Tell the server that no more data will be sent over this stream.
+        It is an error to call send_audio() or send_action() after calling
+        this."""
+        if not self._call.done():
+            await self._call.done_writing()
+
+    async def receive_result(self):
+        """Wait for the next available TranscribeResult from the server.
+        Returns None when there are no more results to receive."""
+        result = await self._call.read()
+        if result is grpc.aio.EOF:
+            return None
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        result = await self.receive_result()
+        if result is None:
+            raise StopAsyncIteration
+        return result
+
+    def cancel(self):
+        """Cancels the stream."""
+        self._call.cancel()
@@ -15,8 +15,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
+import threading
+
+import catalog
+import channels
 import client
 import audio_io
+import bargein
+import metrics
+import prefetch
+import tts_cache
+import vad
+import wakeword
 import cobaltspeech.diatheke.v3.diatheke_pb2 as diatheke_pb2
 
 # Define the client configuration
@@ -26,6 +37,12 @@ server_address = "localhost:9002"
 # server config. Insecure connections are not recommended for production.
 insecure_connection = True
 
+# How long (in seconds) the server version info and model list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
 # The model ID to use when initializing the Diatheke session.
 model_id = "1"
 
@@ -35,11 +52,166 @@ record_cmd = "sox -q -d -c 1 -r 16000 -b 16 -L -e signed -t raw -"
 # The external process responsible for playing audio
 play_cmd = "sox -q -c 1 -r 16000 -b 16 -L -e signed -t raw - -d"
 
-
-def wait_for_input(c, session, input_action):
+# Duration (in milliseconds) of each chunk of recorded audio sent to
+# the server. Smaller frames lower latency at the cost of more requests.
+frame_ms = 20
+
+# Where recorded audio comes from: "process" runs record_cmd once and
+# keeps it running between turns, "sounddevice" records in-process
+# (requires the sounddevice package), and anything else is the path of
+# a raw audio file or FIFO to replay in real time (for headless testing).
+capture_source = "process"
+
+# Where TTS audio is played: "process" runs play_cmd once and keeps it
+# running between replies, "null" discards the audio, and anything else
+# is the path of a raw audio file to write.
+playback_target = "process"
+
+# Audio (in milliseconds) buffered before each reply starts playing, to
+# absorb jitter in the arrival of TTS audio
+prebuffer_ms = 100
+
+# Whether to run voice activity detection on the audio recorded for user
+# input. Only speech (plus a little padding) is sent to Diatheke, and the
+# ASR stream is ended as soon as the user stops talking.
+use_vad = True
+
+# Frames quieter than this (in dBFS) are treated as silence
+vad_energy_threshold = -45.0
+
+# How long (in milliseconds) audio keeps being sent after speech stops
+vad_hangover_ms = 300
+
+# How long (in milliseconds) of silence ends the utterance
+vad_end_silence_ms = 800
+
+# How long (in milliseconds) of continuous speech starts an utterance, so
+# that clicks and coughs are ignored
+vad_min_speech_ms = 100
+
+# Raw audio file (in the recording format) containing a recording of the
+# wake-word, used to detect it locally when Diatheke asks for it. Audio
+# is only streamed to Diatheke after the wake-word is heard. If None, any
+# burst of speech is accepted as the wake-word.
+wake_word_template = None
+
+# How closely the audio must match the template. Lower is stricter.
+wake_word_threshold = 0.6
+
+# Duration (in milliseconds) of the audio before the wake-word detector
+# triggers that is sent along with the user input. It should be long
+# enough to include the wake-word itself.
+wake_word_preroll_ms = 2000
+
+# Whether to start synthesizing every reply in an action list right away,
+# so later replies are ready as soon as the earlier ones finish playing.
+# Prefetched audio is buffered in memory, up to prefetch_max_bytes.
+prefetch_tts = True
+prefetch_max_bytes = 4 * 1024 * 1024
+
+# Whether to open the ASR stream for the user's input (and send the
+# session token) while the last reply is still playing, so that audio
+# starts flowing to Diatheke the moment playback ends. Not used when
+# the input requires the wake-word.
+overlap_asr = True
+
+# Whether the user may interrupt the last reply before their input by
+# speaking. Synthesis is cancelled, playback stops, and the recorded
+# speech is sent as the input. The reply itself may trigger it unless a
+# headset or an echo-cancelling audio device is used.
+barge_in = False
+
+# How long (in milliseconds) the user must speak to interrupt a reply
+barge_in_min_speech_ms = 200
+
+# Directory of the TTS cache. Reply audio is cached by voice, output
+# format and (whitespace-normalized) text, so fixed prompts such as
+# greetings are played from disk without a StreamTTS call. Set to None
+# to disable the cache.
+tts_cache_dir = "./tts_cache"
+
+# Maximum size of the TTS cache, in bytes. The least recently used
+# entries are evicted when the cache grows past this size.
+tts_cache_max_bytes = 256 * 1024 * 1024
+
+# Per-reply latency metrics (connect time, time to the first chunk, gaps
+# between chunks, real-time factor and playback underruns) are appended
+# to metrics_jsonl as JSON lines, and the totals over the session are
+# written to metrics_prometheus in the Prometheus text format. Set either
+# to None to skip it.
+metrics_jsonl = "./tts_metrics.jsonl"
+metrics_prometheus = None
+
+
+class AudioContext(object):
+    """AudioContext holds the audio devices and helpers shared by the
+    turns of a session: the recorder and player, which stay open between
+    turns, a thread for ASR streams opened ahead of time, the voice
+    activity detector (None to send all audio), the wake-word spotter,
+    the barge-in detector, the TTS cache (None to disable it), the TTS
+    metrics recorder, and the output audio format of the session."""
+
+    def __init__(self, recorder, player, output_audio_format, spotter, barge,
+                 tts_metrics, detector=None, cache=None):
+        self.recorder = recorder
+        self.player = player
+        self.output_audio_format = output_audio_format
+        self.spotter = spotter
+        self.barge = barge
+        self.tts_metrics = tts_metrics
+        self.detector = detector
+        self.cache = cache
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def close(self):
+        """Stops the recorder and player and the ASR stream thread."""
+        self.recorder.close()
+        self.player.close()
+        self.executor.shutdown(wait=False)
+
+
+def result_handler(result):
+    """Displays the partial and final ASR results of user input."""
+    if len(result.partial_result.alternatives) != 0:
+        print("\n  Partial Result:", result.partial_result)
+    else:
+        print("\n  ASRResult:")
+        print("    Text: ", result.asr_result.text)
+        print("    Confidence: ", result.asr_result.confidence)
+        print("    cubic result:", result.asr_result.cubic_result)
+
+
+def open_input(c, ctx, session, audio=None):
+    """Opens the ASR stream for the next user input and sends the session
+    token on a background thread, but doesn't send any audio until the
+    returned event is set. Returns the event and a future for the ASR
+    result. Audio is read from the given reader, or from the recorder."""
+    if audio is None:
+        audio = ctx.recorder
+
+    # Send only speech if voice activity detection is enabled
+    if ctx.detector is not None:
+        ctx.detector.reset()
+        audio = vad.VADReader(audio, ctx.detector)
+
+    ready = threading.Event()
+    future = ctx.executor.submit(c.read_asr_audio_with_partial,
+                                 session.token, audio, result_handler,
+                                 ctx.recorder.frame_bytes, ready)
+    return ready, future
+
+
+def wait_for_input(c, ctx, session, input_action, pending=None):
     """Creates a new ASR stream and records audio from the user.
     The audio is sent to Diatheke until an ASR result is returned,
-    which is used to return an updated session."""
+    which is used to return an updated session. If pending is given,
+    it is an ASR stream already set up by open_input()."""
+
+    # Start the recorder
+    recorder = ctx.recorder
+    recorder.start()
+    audio = recorder
+    print("\nStart recording...")
 
     # The given input action has a couple of flags to help the
     # app decide when to begin recording audio.
@@ -53,48 +225,127 @@ def wait_for_input(c, session, input_action):
 
     if input_action.requires_wake_word:
         # This action requires the wake-word to be spoken before
-        # the user input will be accepted. Use a wake-word detector
-        # and wait for it to trigger.
-        pass
-
-    def result_handler(result):
-        if len(result.partial_result.alternatives) != 0:
-            print("\n  Partial Result:", result.partial_result)
-        else:
-            print("\n  ASRResult:")
-            print("    Text: ", result.asr_result.text)
-            print("    Confidence: ", result.asr_result.confidence)
-            print("    cubic result:", result.asr_result.cubic_result)
-
-    # Start the recorder
-    recorder = audio_io.Recorder(cmd=record_cmd)
-    recorder.start()
-    print("\nStart recording...")
+        # the user input will be accepted. Hold the audio locally until
+        # the wake-word detector triggers, then send it along with the
+        # rest of the input.
+        print("Waiting for wake-word...")
+        audio = wakeword.wait_for_wake_word(
+            recorder, ctx.spotter, wake_word_preroll_ms // frame_ms)
+        if audio is None:
+            recorder.stop()
+            raise EOFError("recording ended before the wake-word was heard")
+        print("Wake-word detected ({} frames held locally)".format(audio.held))
 
     # Record until we get an asr_result
-    asr_result = c.read_asr_audio_with_partial(
-        session.token, recorder.process.stdout, result_handler, 8192)
-    recorder.stop()
+    if pending is None:
+        pending = open_input(c, ctx, session, audio)
+    try:
+        while True:
+            ready, future = pending
+            ready.set()
+            asr_result = future.result()
+            if asr_result is not None and asr_result.text != "":
+                break
+            if ctx.detector is None or not ctx.detector.ended:
+                # The recording ended without a result
+                raise EOFError("recording ended before any speech was recognized")
+
+            # The VAD ended the utterance (e.g. on a noise, or a pause
+            # after the wake-word) before any words were recognized.
+            # Listen again on a new stream rather than sending an empty
+            # input to Diatheke.
+            print("\n(No speech recognized, listening again)")
+            pending = open_input(c, ctx, session)
+    finally:
+        recorder.stop()
 
     # ASR result found, process asr result and update session
     return c.process_asr_result(session.token, asr_result)
 
 
-def handle_reply(c, session, reply):
-    """Uses TTS to play back the reply as speech."""
+def handle_reply(c, ctx, session, reply, audio=None, wait=True,
+                 interruptible=False):
+    """Uses TTS to play back the reply as speech. If audio is given, it
+    is the reply's audio prefetched with a prefetch.TTSPrefetcher. If
+    wait is False, returns without waiting for playback to finish, so
+    that a following reply plays without a gap. If interruptible is True,
+    the user may barge in while the reply plays, in which case the frames
+    of audio recorded so far are returned."""
 
     print("\n  Reply:")
     print("    Text: ", reply.text)
     print("    Luna Model: ", reply.luna_model)
 
-    # Start the player
-    player = audio_io.Player(cmd=play_cmd)
-    player.start()
-    c.write_tts_audio(session.token, reply, player.process.stdin)
-    player.stop()
+    player = ctx.player
+    cache = ctx.cache
+    key = reply_key(reply, ctx.output_audio_format)
+    underruns = player.underruns
+
+    # Prefetched replies are timed from when their request was made, and
+    # their chunks are recorded as they arrive
+    request_metrics = getattr(audio, "metrics", None)
+    measured = request_metrics is not None
+    if not measured:
+        request_metrics = ctx.tts_metrics.request(luna_model=reply.luna_model,
+                                                  chars=len(reply.text))
+
+    try:
+        # Use the cached audio for the reply if there is any, or else the
+        # prefetched audio or a new TTS stream. New audio is cached.
+        cancel = getattr(audio, "cancel", None)
+        if cache is not None:
+            if audio is None:
+                audio = cache.stream(key)
+                cancel = lambda: None
+                if audio is not None:
+                    request_metrics.labels["source"] = "cache"
+            else:
+                # Only replies that weren't cached are prefetched
+                cache.count_miss()
+        if audio is None:
+            call = c.new_tts_stream(session.token, reply)
+            request_metrics.labels["source"] = "stream"
+            request_metrics.connected(call)
+            audio, cancel = (data.audio for data in call), call.cancel
+        request_metrics.labels.setdefault("source", "prefetch")
+        if not measured:
+            audio = request_metrics.measure(audio)
+        if cache is not None and key not in cache:
+            audio = cache.record(key, audio)
+
+        frames = None
+        if interruptible:
+            # Play the reply while listening for the user
+            frames = ctx.barge.play(audio, player, cancel)
+            if frames is not None:
+                print("\n  (Interrupted by the user)")
+                request_metrics.labels["interrupted"] = True
+        else:
+            # Play the reply
+            for chunk in audio:
+                player.write(chunk)
+
+            # Wait for it to finish
+            if wait:
+                player.drain()
+    except Exception as err:
+        request_metrics.finish(player.underruns - underruns, err)
+        raise
+
+    request_metrics.finish(player.underruns - underruns)
+    return frames
 
 
-def handle_transcribe(c, scribe):
+def reply_key(reply, output_audio_format):
+    """Returns the TTS cache key for the given reply action, synthesized
+    in the given output audio format."""
+    return tts_cache.cache_key(
+        reply.luna_model,
+        output_audio_format.SerializeToString(deterministic=True).hex(),
+        reply.text)
+
+
+def handle_transcribe(c, ctx, scribe):
     """Creates a new transcribe stream and records audio from
     the user. Displays transcription in the terminal."""
     # Set up the result callback function
@@ -118,11 +369,11 @@ def handle_transcribe(c, scribe):
         final_transcription = final_transcription + result.text
 
     # Start the recorder
-    recorder = audio_io.Recorder(cmd=record_cmd)
+    recorder = ctx.recorder
     recorder.start()
 
     # Run the transcription
-    c.read_transcribe_audio(scribe, recorder.process.stdout, 8192, cb)
+    c.read_transcribe_audio(scribe, recorder, recorder.frame_bytes, cb)
     recorder.stop()
 
     # Display the final transcription
@@ -142,34 +393,90 @@ def handle_command(c, session, cmd):
     return c.process_command_result(session.token, cmd)
 
 
-def process_actions(c, session):
+def process_actions(c, ctx, session):
     """Executes the actions for the given session and returns
     an updated session."""
 
-    # Iterate through each action in the list and determine its type
-    for action in session.action_list:
-        if action.HasField("input"):
-            # The WaitForuserAction will involve a session update.
-            return wait_for_input(c, session, action.input)
-        elif action.HasField("reply"):
-            # Replies do not require a session update.
-            handle_reply(c, session, action.reply)
-        elif action.HasField("command"):
-            # The CommandAction will involve a session update.
-            return handle_command(c, session, action.command)
-        elif action.HasField("transcribe"):
-            # Transcribe actions do not require a session update.
-            handle_transcribe(c, action.transcribe)
-        else:
-            raise RuntimeError("unknown action={}".format(action))
+    actions = session.action_list
+
+    # Start synthesizing the replies that will be played before the next
+    # session update, so each one is ready when the previous one ends.
+    prefetcher = None
+    prefetched = {}
+    if prefetch_tts:
+        prefetcher = prefetch.TTSPrefetcher(c, session.token,
+                                            prefetch_max_bytes,
+                                            ctx.tts_metrics)
+        for i, action in enumerate(actions):
+            if action.HasField("input") or action.HasField("command"):
+                break
+            if action.HasField("reply") and not (
+                    ctx.cache is not None and
+                    reply_key(action.reply, ctx.output_audio_format) in ctx.cache):
+                prefetched[i] = prefetcher.start(action.reply)
+
+    try:
+        # Iterate through each action in the list and determine its type
+        for i, action in enumerate(actions):
+            if action.HasField("input"):
+                # The WaitForuserAction will involve a session update.
+                return wait_for_input(c, ctx, session, action.input)
+            elif action.HasField("reply"):
+                # Replies do not require a session update. Consecutive
+                # replies are played back to back.
+                after = actions[i + 1] if i + 1 < len(actions) else None
+                follows = after is not None and after.HasField("reply")
+                to_input = after is not None and after.HasField("input") and \
+                    not after.input.requires_wake_word
+                if to_input and (overlap_asr or barge_in):
+                    # Set up the input stream while the reply plays. Audio
+                    # recorded during a barge-in is sent ahead of the rest.
+                    handoff = wakeword.PrerollReader([], ctx.recorder)
+                    pending = open_input(c, ctx, session, handoff)
+                    try:
+                        frames = handle_reply(c, ctx, session, action.reply,
+                                              prefetched.get(i),
+                                              interruptible=barge_in)
+                        if frames:
+                            handoff.frames.extend(frames)
+                    except BaseException:
+                        # Release the waiting stream; it fails if the
+                        # recorder isn't running
+                        pending[0].set()
+                        raise
+                    return wait_for_input(c, ctx, session, after.input,
+                                          pending)
+
+                handle_reply(c, ctx, session, action.reply, prefetched.get(i),
+                             wait=not follows)
+            elif action.HasField("command"):
+                # The CommandAction will involve a session update.
+                return handle_command(c, session, action.command)
+            elif action.HasField("transcribe"):
+                # Transcribe actions do not require a session update.
+                handle_transcribe(c, ctx, action.transcribe)
+            else:
+                raise RuntimeError("unknown action={}".format(action))
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
 
 
 if __name__ == "__main__":
-    # Create the client
-    c = client.Client(server_address, insecure_connection)
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    c = client.Client(server_address, insecure_connection,
+                      channel_pool=channels.pool)
+    channels.pool.warmup(wait=False)
+
+    # Look up server info in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
 
     # Print server version info
-    ver = c.version()
+    ver = server_info.get(server_address, "version",
+                          diatheke_pb2.VersionResponse, c.version)
     print("Server Version")
     print("  Diatheke:", ver.diatheke)
     print("  Chosun (NLU):", ver.chosun)
@@ -178,7 +485,9 @@ if __name__ == "__main__":
     print("")
 
     # Print the list of available models on the server
-    model_list = c.list_models()
+    model_list = server_info.get(
+        server_address, "models", diatheke_pb2.ListModelsResponse,
+        lambda: diatheke_pb2.ListModelsResponse(models=c.list_models())).models
     print("Available Models:")
     for mdl in model_list:
         print("  ID:", mdl.id)
@@ -198,6 +507,59 @@ if __name__ == "__main__":
                                                    codec=diatheke_pb2.AUDIO_CODEC_RAW,
                                                    encoding=diatheke_pb2.AUDIO_ENCODING_SIGNED,
                                                    byte_order=diatheke_pb2.BYTE_ORDER_LITTLE_ENDIAN)
+    # Set up the recorder, which stays open across turns so that it can
+    # start capturing immediately each time the user is expected to speak
+    recorder = audio_io.Recorder(
+        backend=audio_io.capture_backend(capture_source, record_cmd),
+        frame_ms=frame_ms)
+
+    # Set up voice activity detection
+    detector = None
+    if use_vad:
+        detector = vad.VAD(frame_ms=frame_ms,
+                           energy_threshold=vad_energy_threshold,
+                           hangover_ms=vad_hangover_ms,
+                           end_silence_ms=vad_end_silence_ms,
+                           min_speech_ms=vad_min_speech_ms)
+
+    # Set up barge-in detection, which uses its own VAD so that it
+    # doesn't disturb the state of the input one
+    barge = bargein.BargeIn(
+        recorder,
+        vad.VAD(frame_ms=frame_ms, energy_threshold=vad_energy_threshold),
+        frame_ms=frame_ms, min_speech_ms=barge_in_min_speech_ms)
+
+    # Set up the local wake-word detector
+    if wake_word_template is not None:
+        spotter = wakeword.load_template(wake_word_template,
+                                         recorder.frame_bytes,
+                                         wake_word_threshold)
+    else:
+        spotter = wakeword.EnergySpotter(
+            vad.VAD(frame_ms=frame_ms, energy_threshold=vad_energy_threshold),
+            frame_ms=frame_ms)
+
+    # Set up the TTS cache
+    cache = None
+    if tts_cache_dir is not None:
+        cache = tts_cache.TTSCache(tts_cache_dir, tts_cache_max_bytes)
+
+    # Set up the player, which likewise stays open across replies
+    player = audio_io.PlaybackSink(
+        sample_rate=output_audio_format.sample_rate, prebuffer_ms=prebuffer_ms,
+        output=audio_io.playback_backend(playback_target, play_cmd))
+
+    # Set up the TTS metrics, using the output format to compute audio
+    # durations
+    tts_metrics = metrics.Recorder(
+        output_audio_format.sample_rate,
+        sample_width=output_audio_format.bit_depth // 8,
+        channels=output_audio_format.channels,
+        jsonl_path=metrics_jsonl, prometheus_path=metrics_prometheus)
+
+    ctx = AudioContext(recorder, player, output_audio_format, spotter, barge,
+                       tts_metrics, detector, cache)
+
     session = c.create_session(model_id,
                                input_audio_format=input_audio_format,
                                output_audio_format=output_audio_format).session_output
@@ -205,7 +567,7 @@ if __name__ == "__main__":
     try:
         # Run the main loop
         while True:
-            res = process_actions(c, session).session_output
+            res = process_actions(c, ctx, session).session_output
 
             # Update session only if next action list is not empty.
             if len(res.action_list) != 0:
@@ -216,4 +578,14 @@ if __name__ == "__main__":
     finally:
         # Clean up the session when we are done
         c.delete_session(session.token)
+        ctx.close()
         print("Session closed")
+        print("Playback underruns:", player.underruns)
+        if detector is not None:
+            print("VAD dropped {} of {} frames".format(detector.dropped,
+                                                       detector.frames))
+        if barge_in:
+            print("Barge-in:", barge.summary())
+        if cache is not None:
+            print(cache.summary())
+        print(tts_metrics.summary())
@@ -15,49 +15,372 @@
 # limitations under the License.
 
 import subprocess
+import threading
+import time
 
 
-class Recorder(object):
-    """Recorder launches an external application to handle recording audio."""
+class FrameReader(object):
+    """FrameReader reads fixed-size frames of audio from a capture source
+    (anything with a readinto() method) on a background thread, so the
+    source is drained continuously and frames are available with
+    predictable latency. Frames are read directly into a preallocated ring
+    buffer; no memory is allocated per frame.
+
+    For live sources, frames are never held back: if the consumer falls
+    behind and the ring fills up, new frames are dropped and counted as
+    overruns, and frames captured while the reader is paused are
+    discarded. For other sources (e.g. files), reading simply waits for
+    space in the ring, or for the reader to be resumed."""
+
+    def __init__(self, stream, frame_bytes, ring_frames=50, live=True):
+        self.frame_bytes = frame_bytes
+        self.live = live
+        self.overruns = 0
+
+        # The ring holds ring_frames frames; one extra scratch frame
+        # absorbs audio that arrives while the ring is full.
+        self._stream = stream
+        self._buf = bytearray(frame_bytes * (ring_frames + 1))
+        view = memoryview(self._buf)
+        self._slots = [view[i * frame_bytes:(i + 1) * frame_bytes]
+                       for i in range(ring_frames + 1)]
+        self._scratch = self._slots.pop()
+        self._lengths = [frame_bytes] * ring_frames
+
+        self._cond = threading.Condition()
+        self._head = 0  # number of frames consumed
+        self._tail = 0  # number of frames captured
+        self._paused = False
+        self._closed = False
+        self._eof = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        n = len(self._slots)
+        while True:
+            # The slot returned last by read_frame() must stay intact
+            # until the next call, so at most n - 1 frames are buffered.
+            with self._cond:
+                if not self.live:
+                    self._cond.wait_for(lambda: self._closed or (
+                        not self._paused and self._tail - self._head < n - 1))
+                if self._closed:
+                    break
+                discard = self._paused
+                full = self._tail - self._head >= n - 1
+            target = self._scratch if discard or full else self._slots[self._tail % n]
+
+            got = self._fill(target)
+            if got == 0:
+                break
+
+            with self._cond:
+                if not (self._paused or discard):
+                    if full and self._tail - self._head < n - 1:
+                        # The consumer caught up while we were reading
+                        self._slots[self._tail % n][:got] = target[:got]
+                        full = False
+                    if full:
+                        self.overruns += 1
+                    else:
+                        self._lengths[self._tail % n] = got
+                        self._tail += 1
+                        self._cond.notify_all()
+
+            if got < self.frame_bytes:
+                # A short frame only happens at the end of the stream
+                break
+
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def _fill(self, target):
+        # Sources may return short reads, so keep reading until the frame
+        # is complete. Returns the number of bytes read, which is less
+        # than a full frame only at the end of the stream.
+        got = 0
+        while got < self.frame_bytes:
+            try:
+                n = self._stream.readinto(target[got:])
+            except Exception:
+                # The source was closed or failed
+                break
+            if not n:
+                break
+            got += n
+        return got
+
+    def read_frame(self, block=True, timeout=None):
+        """Returns the next frame as a memoryview into the ring buffer,
+        which stays valid until the next call. Returns an empty bytes
+        object at the end of the stream or while the reader is paused,
+        or None if no frame is ready (when block is False or the timeout
+        expires)."""
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self._tail > self._head or
+                                    self._eof or self._paused, timeout)
+            if self._paused:
+                return b""
+            if self._tail > self._head:
+                i = self._head % len(self._slots)
+                self._head += 1
+                self._cond.notify_all()
+                if self._lengths[i] < self.frame_bytes:
+                    return self._slots[i][:self._lengths[i]]
+                return self._slots[i]
+            if self._eof:
+                return b""
+            return None
+
+    def read(self, size=None):
+        """Blocks until the next frame is available and returns a copy of
+        it, or an empty bytes object at the end of the stream or while the
+        reader is paused. The size argument is ignored; frames always have
+        the configured size."""
+        frame = self.read_frame()
+        return bytes(frame)
+
+    def pause(self):
+        """Stops delivering frames. Blocked readers return immediately
+        with an empty bytes object, and frames not yet consumed are
+        discarded."""
+        with self._cond:
+            self._paused = True
+            self._head = self._tail
+            self._cond.notify_all()
 
-    def __init__(self, cmd, bufsize=8096):
+    def resume(self):
+        """Resumes delivering frames after pause()."""
+        with self._cond:
+            self._head = self._tail
+            self._paused = False
+            self._cond.notify_all()
+
+    def close(self):
+        """Stops the reader thread. The source should be closed as well,
+        to interrupt a read in progress."""
+        with self._cond:
+            self._closed = True
+            self._paused = True
+            self._cond.notify_all()
+
+    def pending(self):
+        """Returns the number of captured frames not yet consumed."""
+        with self._cond:
+            return self._tail - self._head
+
+    def join(self, timeout=None):
+        """Waits for the reader thread to reach the end of the stream."""
+        self._thread.join(timeout)
+
+
+class ProcessCapture(object):
+    """ProcessCapture captures audio from the stdout of an external
+    application, such as sox or arecord. If persistent is True, the
+    application keeps running between recordings so that starting the
+    next one is immediate."""
+
+    live = True
+
+    def __init__(self, cmd, persistent=False):
         self.args = cmd.split()
-        self.bufsize = bufsize
+        self.persistent = persistent
         self.process = None
 
-    def start(self):
+    def open(self):
         """Start the external recording application."""
+        # Its output is unbuffered so that frames are read straight into
+        # the frame reader's ring buffer.
+        self.process = subprocess.Popen(args=self.args,
+                                        bufsize=0,
+                                        stdout=subprocess.PIPE)
+
+    def readinto(self, buf):
+        return self.process.stdout.readinto(buf)
+
+    def close(self):
+        """Stop the external recording application."""
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+class SoundDeviceCapture(object):
+    """SoundDeviceCapture records 16-bit audio in-process from a sound
+    card using the sounddevice package (pip install sounddevice), with no
+    external application. The input stream stays open between recordings,
+    so starting the next one is immediate."""
+
+    live = True
+    persistent = True
+
+    def __init__(self, sample_rate=16000, channels=1, device=None,
+                 latency="low"):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.device = device
+        self.latency = latency
+        self._stream = None
+
+    def open(self):
+        """Open and start the input stream."""
+        import sounddevice
+        self._stream = sounddevice.RawInputStream(samplerate=self.sample_rate,
+                                                  channels=self.channels,
+                                                  dtype="int16",
+                                                  device=self.device,
+                                                  latency=self.latency)
+        self._stream.start()
+
+    def readinto(self, buf):
+        frames = len(buf) // (2 * self.channels)
+        data, _ = self._stream.read(frames)
+        n = len(data)
+        buf[:n] = data
+        return n
+
+    def close(self):
+        """Stop and close the input stream."""
+        self._stream.stop()
+        self._stream.close()
+
+
+class FileCapture(object):
+    """FileCapture replays raw audio from a file or FIFO, for testing
+    without a microphone. If bytes_per_second is given, the audio is
+    paced to play out in real time and treated as a live source;
+    otherwise it is read as fast as it is consumed. The file stays open
+    between recordings, so each recording continues where the last one
+    stopped."""
+
+    persistent = True
+
+    def __init__(self, path, bytes_per_second=None):
+        self.path = path
+        self.bytes_per_second = bytes_per_second
+        self.live = bytes_per_second is not None
+        self._file = None
+
+    def open(self):
+        """Open the file."""
+        self._file = open(self.path, "rb", buffering=0)
+        self._start = time.monotonic()
+        self._sent = 0
+
+    def readinto(self, buf):
+        n = self._file.readinto(buf)
+        if n and self.bytes_per_second:
+            # Wait until this audio would have been captured live
+            self._sent += n
+            delay = self._start + self._sent / self.bytes_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return n
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+def capture_backend(source, cmd, sample_rate=16000, sample_width=2, channels=1):
+    """Returns a capture backend for the given source: "process" runs cmd
+    and keeps it running between recordings, "sounddevice" records
+    in-process, and any other value is the path of a raw audio file or
+    FIFO to replay in real time."""
+    if source == "process":
+        return ProcessCapture(cmd, persistent=True)
+    if source == "sounddevice":
+        return SoundDeviceCapture(sample_rate, channels)
+    return FileCapture(source, sample_rate * sample_width * channels)
+
+
+class Recorder(object):
+    """Recorder captures audio from a capture backend. By default the
+    backend is a ProcessCapture that launches an external application
+    (cmd) to handle recording audio. The audio is delivered in frames of
+    frame_ms milliseconds, sized from the sample rate, sample width
+    (bytes) and channel count of the captured audio.
+
+    If the backend is persistent, stop() only pauses delivery; the source
+    stays open so the next start() takes effect immediately. Call close()
+    to release the backend."""
+
+    def __init__(self, cmd=None, sample_rate=16000, sample_width=2,
+                 channels=1, frame_ms=20, backend=None):
+        if backend is None:
+            backend = ProcessCapture(cmd)
+        self.backend = backend
+        self.frame_bytes = sample_rate * sample_width * channels * frame_ms // 1000
+        self.reader = None
+        self.recording = False
+
+    def start(self):
+        """Start recording."""
 
         # Ignore if we already started it
-        if self.process is not None:
+        if self.recording:
             return
 
-        # Start the subprocess
-        self.process = subprocess.Popen(args=self.args,
-                                        bufsize=self.bufsize,
-                                        stdout=subprocess.PIPE)
+        if self.reader is None:
+            self.backend.open()
+            self.reader = FrameReader(self.backend, self.frame_bytes,
+                                      live=self.backend.live)
+        else:
+            self.reader.resume()
+        self.recording = True
 
     def stop(self):
-        """Stop the external recording application."""
+        """Stop recording."""
 
         # Ignore if it is not running
-        if self.process is None:
+        if not self.recording:
             return
 
-        # Stop the subprocess
-        self.process.stdout.close()
-        self.process.terminate()
-        self.process = None
+        self.recording = False
+        if self.backend.persistent:
+            self.reader.pause()
+        else:
+            self.close()
 
-    def read(self):
-        """Read audio data from the external recording application."""
+    def close(self):
+        """Stop recording and release the capture backend."""
+        self.recording = False
+        if self.reader is None:
+            return
 
-        # Raise an error if we haven't started the app
-        if self.process is None:
-            raise RuntimeError("Recording application is not running")
+        # Closing the backend interrupts a read in progress, which lets the
+        # frame reader thread finish.
+        self.reader.close()
+        self.backend.close()
+        self.reader.join()
+        self.reader = None
 
-        # Get the data from stdout
-        return self.process.stdout.read(self.bufsize)
+    def read(self, bufsize=None):
+        """Read the next frame of audio data. This blocks until a full
+        frame is available, and returns an empty bytes object once
+        recording stops. The bufsize argument is ignored; frames always
+        have the configured duration."""
+
+        # Raise an error if we haven't started recording
+        if not self.recording:
+            raise RuntimeError("Recorder is not running")
+
+        return self.reader.read()
+
+    def read_frame(self, block=True, timeout=None):
+        """Like read(), but returns a memoryview into the frame reader's
+        ring buffer instead of a copy. See FrameReader.read_frame()."""
+
+        # Raise an error if we haven't started recording
+        if not self.recording:
+            raise RuntimeError("Recorder is not running")
+
+        return self.reader.read_frame(block, timeout)
 
 
 class Player(object):
@@ -101,3 +424,220 @@ class Player(object):
 
         # Write the audio data to the external application's stdin.
         self.process.stdin.write(audio)
+
+
+class ProcessOutput(object):
+    """ProcessOutput plays audio through an external application, such
+    as sox or aplay, that reads audio data from stdin. The application is
+    started once and kept running for as long as the output is open."""
+
+    def __init__(self, cmd):
+        self.args = cmd.split()
+        self.process = None
+
+    def open(self):
+        """Start the external playback application."""
+        self.process = subprocess.Popen(args=self.args,
+                                        stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def close(self):
+        """Stop the external playback application."""
+        self.process.stdin.close()
+        self.process.wait()
+        self.process = None
+
+
+class FileOutput(object):
+    """FileOutput writes the played audio to a raw audio file, for
+    benchmarking or testing without a sound card."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self):
+        """Open the file."""
+        self._file = open(self.path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+class NullOutput(object):
+    """NullOutput discards the played audio, for benchmarking without a
+    sound card."""
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def playback_backend(target, cmd):
+    """Returns a playback output for the given target: "process" runs cmd
+    and keeps it running between utterances, "null" discards the audio,
+    and any other value is the path of a raw audio file to write."""
+    if target == "process":
+        return ProcessOutput(cmd)
+    if target == "null":
+        return NullOutput()
+    return FileOutput(target)
+
+
+class PlaybackSink(object):
+    """PlaybackSink is a long-lived audio player that accepts successive
+    utterances. Audio written to the sink is played on a background thread
+    through an output backend (by default a ProcessOutput running cmd),
+    which stays open until the sink is closed.
+
+    The sink is paced by the playback clock, computed from the sample
+    rate, sample width (bytes) and channel count of the audio. Each
+    utterance starts playing once prebuffer_ms of audio has been buffered,
+    which absorbs jitter in the arrival of network audio, and the output
+    is kept at most prebuffer_ms ahead of the clock so that flush() can
+    stop playback promptly. If the buffer runs dry before the end of an
+    utterance, an underrun is counted and the sink prebuffers again."""
+
+    def __init__(self, cmd=None, sample_rate=16000, sample_width=2,
+                 channels=1, prebuffer_ms=100, period_ms=20, output=None):
+        if output is None:
+            output = ProcessOutput(cmd)
+        self.output = output
+        self.bytes_per_second = sample_rate * sample_width * channels
+        frame = sample_width * channels
+        self.prebuffer_bytes = self.bytes_per_second * prebuffer_ms // 1000 // frame * frame
+        self.period_bytes = max(frame, self.bytes_per_second * period_ms // 1000 // frame * frame)
+        self.underruns = 0
+        self.bytes_played = 0
+
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._active = False      # an utterance is in progress
+        self._ended = True        # no more audio for the current utterance
+        self._prebuffering = True
+        self._play_until = 0.0    # when the audio written so far finishes
+        self._closed = False
+
+        self.output.open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        lead = self.prebuffer_bytes / float(self.bytes_per_second)
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    if self._prebuffering and (
+                            len(self._buf) >= self.prebuffer_bytes or
+                            (self._ended and self._buf)):
+                        self._prebuffering = False
+                    if self._buf and not self._prebuffering:
+                        if self._play_until - now <= lead:
+                            break
+                        # Keep the output no more than lead seconds ahead
+                        self._cond.wait(self._play_until - now - lead)
+                        continue
+                    if not self._buf and self._active and now >= self._play_until:
+                        if self._ended:
+                            # Everything written has been played
+                            self._active = False
+                            self._cond.notify_all()
+                        elif not self._prebuffering:
+                            # Ran dry in the middle of an utterance
+                            self.underruns += 1
+                            self._prebuffering = True
+                    timeout = None
+                    if self._active and self._play_until > now:
+                        timeout = self._play_until - now
+                    self._cond.wait(timeout)
+
+                chunk = bytes(self._buf[:self.period_bytes])
+                del self._buf[:len(chunk)]
+
+            try:
+                self.output.write(chunk)
+            except (OSError, ValueError):
+                # The output was closed or failed
+                return
+
+            with self._cond:
+                now = time.monotonic()
+                self._play_until = max(self._play_until, now) + \
+                    len(chunk) / float(self.bytes_per_second)
+                self.bytes_played += len(chunk)
+
+    def write(self, audio):
+        """Adds audio data to the current utterance, starting a new one if
+        none is in progress. Audio should be binary data."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Playback sink is closed")
+            if self._ended:
+                self._active = True
+                self._ended = False
+                self._prebuffering = True
+            self._buf += audio
+            self._cond.notify_all()
+
+    def push_audio(self, audio):
+        """Same as write(), for compatibility with Player."""
+        self.write(audio)
+
+    def end(self):
+        """Marks the end of the current utterance, so that the rest of it
+        is played even if it is shorter than the prebuffer."""
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Ends the current utterance and waits until it has been played.
+        Returns False if the timeout expired first."""
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._active or self._closed, timeout)
+
+    def flush(self):
+        """Discards the buffered audio of the current utterance, e.g. when
+        the user barges in. Audio already handed to the output (at most
+        prebuffer_ms) is not recalled."""
+        with self._cond:
+            del self._buf[:]
+            self._ended = True
+            self._active = False
+            self._prebuffering = True
+            self._play_until = min(self._play_until, time.monotonic())
+            self._cond.notify_all()
+
+    def playing(self):
+        """Returns True while an utterance is being played."""
+        with self._cond:
+            return self._active
+
+    def close(self):
+        """Stops playback, discarding any buffered audio, and closes the
+        output."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.output.close()
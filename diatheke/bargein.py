@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+
+class BargeIn(object):
+    """BargeIn plays TTS audio while recording, so the user can interrupt
+    a reply by speaking. Speech is detected with the given VAD; once
+    min_speech_ms of continuous speech is heard, the TTS stream is
+    cancelled (stopping synthesis on the server), the playback sink is
+    flushed, and the recorded audio is returned so it can be sent as the
+    user's input.
+
+    The time from the start of the interrupting speech to the moment
+    playback was stopped is recorded in reaction_times (in seconds)."""
+
+    def __init__(self, recorder, detector, frame_ms=20, min_speech_ms=200,
+                 preroll_ms=300):
+        self.recorder = recorder
+        self.detector = detector
+        self.frame_seconds = frame_ms / 1000.0
+        self.min_frames = max(1, min_speech_ms // frame_ms)
+        self.preroll_frames = self.min_frames + max(0, preroll_ms // frame_ms)
+        self.reaction_times = []
+
+    def play(self, audio, player, cancel):
+        """Plays audio (an iterable of audio chunks, such as the audio of a
+        StreamTTS call) through the player while listening for speech.
+        cancel is called to stop the TTS stream when the user barges in.
+        Returns the recorded frames, starting a little before the speech,
+        if the user barged in, or None once the audio has finished
+        playing. The recorder is left running in both cases."""
+        stop = threading.Event()
+        done = threading.Event()
+        errors = []
+
+        def consume():
+            try:
+                for chunk in audio:
+                    if stop.is_set():
+                        break
+                    player.write(chunk)
+            except Exception as err:
+                # Cancelling the stream raises an error here
+                if not stop.is_set():
+                    errors.append(err)
+            finally:
+                player.end()
+                done.set()
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+
+        self.recorder.start()
+        frames = collections.deque(maxlen=self.preroll_frames)
+        speech = 0
+        onset = None
+        try:
+            while not (done.is_set() and not player.playing()):
+                frame = self.recorder.read()
+                if not frame:
+                    # The recording ended; just let the reply finish
+                    player.drain()
+                    break
+                now = time.monotonic()
+                frames.append(frame)
+                if not self.detector.is_speech(frame):
+                    speech = 0
+                    continue
+                if speech == 0:
+                    # The frame was captured one frame duration ago
+                    onset = now - self.frame_seconds
+                speech += 1
+                if speech >= self.min_frames:
+                    stop.set()
+                    cancel()
+                    player.flush()
+                    self.reaction_times.append(time.monotonic() - onset)
+                    return list(frames)
+        finally:
+            stop.set()
+            consumer.join()
+
+        if errors:
+            raise errors[0]
+        return None
+
+    def summary(self):
+        """Returns a short description of the barge-ins so far."""
+        if not self.reaction_times:
+            return "no barge-ins"
+        times = sorted(self.reaction_times)
+        return "{} barge-in(s), reaction time mean {:.0f} ms, max {:.0f} ms".format(
+            len(times), 1000 * sum(times) / len(times), 1000 * times[-1])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; see Catalog
+    fcntl = None
+
+# Default location of the catalog cache file
+default_path = os.path.join(os.path.expanduser("~"), ".cache", "cobalt",
+                            "catalog.json")
+
+
+class Catalog(object):
+    """Catalog is a small on-disk cache of server metadata, such as the
+    version info and the list of available models or voices. Entries are
+    keyed by server address, entry name and message type, and expire after
+    ttl seconds, so short-lived clients can skip those RPCs at startup and
+    go straight to their first real request. The message type is part of
+    the key because the cubic, luna and diatheke examples share one file
+    and may talk to servers at the same address.
+
+    Updates are merged into the file under an exclusive lock on a
+    neighbouring .lock file, so concurrent processes don't lose each
+    other's entries. Where file locking (fcntl) is unavailable, e.g. on
+    Windows, a concurrent update may be lost; the entry is then simply
+    fetched again on the next run."""
+
+    def __init__(self, path=default_path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Serializes load-modify-save across threads and, where possible,
+        # across processes
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path + ".lock", "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(name, message_class):
+        return "{}:{}".format(name, message_class.DESCRIPTOR.full_name)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        # Write to a temporary file first so other processes never see a
+        # partially written catalog.
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".catalog")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, address, name, message_class, fetch):
+        """Returns the cached message stored under name for the given server
+        address. If there is no unexpired entry, fetch() is called to get a
+        fresh message (of type message_class), which is cached and returned."""
+        key = self._key(name, message_class)
+        with self._lock:
+            entry = self._load().get(address, {}).get(key)
+        if entry is not None and time.time() - entry["time"] < self.ttl:
+            return message_class.FromString(base64.b64decode(entry["data"]))
+
+        msg = fetch()
+        with self._locked():
+            entries = self._load()
+            entries.setdefault(address, {})[key] = {
+                "time": time.time(),
+                "data": base64.b64encode(msg.SerializeToString()).decode("ascii"),
+            }
+            self._save(entries)
+        return msg
+
+    def invalidate(self, address=None, name=None):
+        """Removes cached entries. If address is None, all servers are
+        removed; if name is None, all entries for the address are removed."""
+        with self._locked():
+            entries = self._load()
+            if address is None:
+                entries = {}
+            elif name is None:
+                entries.pop(address, None)
+            else:
+                server = entries.get(address, {})
+                for key in list(server):
+                    if key.split(":", 1)[0] == name:
+                        del server[key]
+            self._save(entries)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import grpc
+
+
+class ChannelPool(object):
+    """ChannelPool shares gRPC channels between clients. One channel is
+    created per (address, credentials) combination and reused by every
+    client that asks for it, so a process pays for the TCP and TLS
+    handshakes only once per server. Channels are configured with HTTP/2
+    keepalive pings so connections aren't silently dropped by proxies.
+
+    By default, pings are only sent while a call is in progress, and no
+    more often than every 5 minutes, which is the most a gRPC server
+    accepts with its default settings; pinging more often makes the
+    server close the connection with a too_many_pings GOAWAY. Setting
+    keepalive_without_calls also pings idle connections (e.g. a Diatheke
+    session waiting for the user), which is only safe if the server is
+    configured to permit it (grpc.keepalive_permit_without_calls and a
+    grpc.http2.min_ping_interval_without_data_ms no longer than
+    keepalive_ms)."""
+
+    def __init__(self, keepalive_ms=300000, keepalive_timeout_ms=20000,
+                 keepalive_without_calls=False,
+                 max_message_bytes=64 * 1024 * 1024):
+        self.options = [
+            ("grpc.keepalive_time_ms", keepalive_ms),
+            ("grpc.keepalive_timeout_ms", keepalive_timeout_ms),
+            ("grpc.keepalive_permit_without_calls",
+             1 if keepalive_without_calls else 0),
+            ("grpc.max_send_message_length", max_message_bytes),
+            ("grpc.max_receive_message_length", max_message_bytes),
+        ]
+        if keepalive_without_calls:
+            self.options.append(("grpc.http2.max_pings_without_data", 0))
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._shared = {}
+
+    def channel(self, address, insecure=False, root_certificates=None,
+                private_key=None, certificate_chain=None):
+        """Returns the shared channel for the given address and credentials,
+        creating it if needed. The arguments have the same meaning as for
+        grpc.ssl_channel_credentials(); they are ignored if insecure is set."""
+        key = (address, insecure, root_certificates, private_key,
+               certificate_chain)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                if insecure:
+                    channel = grpc.insecure_channel(address, options=self.options)
+                else:
+                    creds = grpc.ssl_channel_credentials(
+                        root_certificates=root_certificates,
+                        private_key=private_key,
+                        certificate_chain=certificate_chain)
+                    channel = grpc.secure_channel(address, creds,
+                                                  options=self.options)
+                self._channels[key] = channel
+            return channel
+
+    def shared(self, channel, factory):
+        """Returns the object built by factory(channel) for the given pooled
+        channel, calling factory only the first time. This lets an SDK
+        client that wraps a channel be shared along with the channel."""
+        with self._lock:
+            obj = self._shared.get(id(channel))
+            if obj is None:
+                obj = factory(channel)
+                self._shared[id(channel)] = obj
+            return obj
+
+    def warmup(self, timeout=None, wait=True):
+        """Starts connecting every channel in the pool. If wait is True,
+        blocks until all of them are ready, raising grpc.FutureTimeoutError
+        if that takes longer than timeout seconds. Otherwise the connections
+        are made in the background and the readiness futures are returned."""
+        with self._lock:
+            channels = list(self._channels.values())
+        futures = [grpc.channel_ready_future(channel) for channel in channels]
+        if wait:
+            for future in futures:
+                future.result(timeout=timeout)
+        return futures
+
+    def open_channels(self):
+        """Returns the number of channels currently held by the pool."""
+        with self._lock:
+            return len(self._channels)
+
+    def close(self):
+        """Closes all of the channels in the pool."""
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+            self._shared.clear()
+        for channel in channels:
+            channel.close()
+
+
+# The pool shared by the clients in this process
+pool = ChannelPool()
@@ -15,7 +15,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import catalog
+import channels
 import client
+import cobaltspeech.diatheke.v3.diatheke_pb2 as diatheke_pb2
 
 
 # Define the client configuration
@@ -25,6 +28,12 @@ server_address = "localhost:9002"
 # server config. Insecure connections are not recommended for production.
 insecure_connection = True
 
+# How long (in seconds) the server version info and model list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
 # The model ID to use when initializing the Diatheke session.
 model_id = "demo"
 
@@ -91,11 +100,20 @@ def process_actions(c, session):
 
 
 if __name__ == "__main__":
-    # Create the client
-    c = client.Client(server_address, insecure_connection)
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    c = client.Client(server_address, insecure_connection,
+                      channel_pool=channels.pool)
+    channels.pool.warmup(wait=False)
+
+    # Look up server info in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
 
     # Print server version info
-    ver = c.version()
+    ver = server_info.get(server_address, "version",
+                          diatheke_pb2.VersionResponse, c.version)
     print("Server Version")
     print("  Diatheke:", ver.diatheke)
     print("  Chosun (NLU):", ver.chosun)
@@ -104,7 +122,9 @@ if __name__ == "__main__":
     print("")
 
     # Print the list of available models on the server
-    model_list = c.list_models()
+    model_list = server_info.get(
+        server_address, "models", diatheke_pb2.ListModelsResponse,
+        lambda: diatheke_pb2.ListModelsResponse(models=c.list_models())).models
     print("Available Models:")
     for mdl in model_list:
         print("  ID:", mdl.id)
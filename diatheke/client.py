@@ -19,14 +19,15 @@ import io
 import cobaltspeech.diatheke.v3.diatheke_pb2 as diatheke_pb2
 
 from cobaltspeech.diatheke.v3.diatheke_pb2_grpc import DiathekeServiceStub
-from streams import ASRStream, TranscribeStream
+from streams import ASRStream, TranscribeStream, BLOCK
 
 
 class Client(object):
     def __init__(self, server_address, insecure=False,
                  server_certificate=None,
                  client_certificate=None,
-                 client_key=None):
+                 client_key=None,
+                 channel_pool=None):
         """  Creates a new Diatheke Client object.
         Args:
             server_address: host:port of where Diatheke server is running (string)
@@ -43,19 +44,31 @@ class Client(object):
             client_key:  PEM key as byte string presented by this Client when
                          connecting to a server. Use this when setting up mutually
                          authenticated TLS. The clientCertificate must also be provided.
+            channel_pool:  Optional channels.ChannelPool. If given, the client uses
+                           the pool's shared channel for this server and credentials
+                           instead of creating its own, and does not close it.
         """
         self.server_address = server_address
         self.insecure = insecure
+        self._owns_channel = channel_pool is None
 
-        if insecure:
-            # no transport layer security (TLS)
-            self._channel = grpc.insecure_channel(server_address)
-        else:
+        if not insecure:
             # using a TLS endpoint with optional certificates for mutual authentication
             if client_certificate is not None and client_key is None:
                 raise ValueError("client key must also be provided")
             if client_key is not None and client_certificate is None:
                 raise ValueError("client certificate must also be provided")
+
+        if channel_pool is not None:
+            self._channel = channel_pool.channel(
+                server_address, insecure,
+                root_certificates=server_certificate,
+                private_key=client_key,
+                certificate_chain=client_certificate)
+        elif insecure:
+            # no transport layer security (TLS)
+            self._channel = grpc.insecure_channel(server_address)
+        else:
             self._creds = grpc.ssl_channel_credentials(
                 root_certificates=server_certificate,
                 private_key=client_key,
@@ -67,7 +80,8 @@ class Client(object):
     def __del__(self):
         """ Closes and cleans up the client. """
         try:
-            self._channel.close()
+            if self._owns_channel:
+                self._channel.close()
         except AttributeError:
             # client wasn't fully instantiated, no channel to close
             pass
@@ -133,11 +147,19 @@ class Client(object):
             session_input=diatheke_pb2.SessionInput(token=token, story=story))
         return self._client.UpdateSession(req)
 
-    def new_session_asr_stream(self, token):
+    def new_session_asr_stream(self, token, queue_depth=32, policy=BLOCK,
+                               coalesce_bytes=0, coalesce_ms=0):
         """Creates a new stream to transcribe audio for the given
-        session token."""
+        session token. Up to queue_depth requests are buffered for
+        sending, and policy (streams.BLOCK, DROP_OLDEST or COALESCE)
+        decides what happens to audio sent while the buffer is full.
+        If coalesce_bytes is set, small audio writes are merged into
+        messages of up to that size, delaying them by at most
+        coalesce_ms."""
         # Create the ASR stream object and send the session token
-        stream = ASRStream(client_stub=self._client)
+        stream = ASRStream(client_stub=self._client, queue_depth=queue_depth,
+                           policy=policy, coalesce_bytes=coalesce_bytes,
+                           coalesce_ms=coalesce_ms)
         stream.send_token(token)
         return stream
 
@@ -147,15 +169,20 @@ class Client(object):
         return self._client.StreamTTS(diatheke_pb2.StreamTTSRequest(
             reply_action=reply, token=token))
 
-    def new_transcribe_stream(self, action):
+    def new_transcribe_stream(self, action, queue_depth=32, policy=BLOCK,
+                              coalesce_bytes=0, coalesce_ms=0):
         """Creates a new stream for transcriptions usually in response to
         a transcribe action in the session output. This stream differs from
         an ASR stream in purpose - where a session's ASR stream accepts audio
         to continue a conversation with the system, a transcribe stream
         accepts audio for the sole purpose of getting a transcription that
         the client can use for any purpose (e.g., note taking, send a message,
-        etc.)."""
-        stream = TranscribeStream(client_stub=self._client)
+        etc.). The buffering and coalescing arguments are the same as for
+        new_session_asr_stream()."""
+        stream = TranscribeStream(client_stub=self._client,
+                                  queue_depth=queue_depth, policy=policy,
+                                  coalesce_bytes=coalesce_bytes,
+                                  coalesce_ms=coalesce_ms)
         stream.send_action(action)
         return stream
 
@@ -182,10 +209,16 @@ class Client(object):
         # Run the stream
         return self._client.StreamASR(send_data())
 
-    def read_asr_audio_with_partial(self, token, reader, result_handler, buff_size):
+    def read_asr_audio_with_partial(self, token, reader, result_handler, buff_size,
+                                    ready=None):
         """Convenience function to create an ASR stream and send audio
         from the given reader to the stream. This function blocks until
-        a result is returned. Data is sent in chunks defined by buff_size."""
+        a result is returned. Data is sent in chunks defined by buff_size.
+
+        If ready (a threading.Event) is given, the stream is opened and
+        the token sent right away, but no audio is read until ready is
+        set. This lets the stream be set up ahead of time, e.g. while a
+        reply is still playing."""
         # Check if we have a text or byte reader
         is_text = isinstance(reader, io.TextIOBase)
 
@@ -193,6 +226,8 @@ class Client(object):
         # data to Diatheke.
         def send_data():
             yield diatheke_pb2.StreamASRWithPartialsRequest(token=token)
+            if ready is not None:
+                ready.wait()
             while True:
                 data = reader.read(buff_size)
                 if (is_text and data == '') or (not is_text and data == b''):
@@ -212,21 +247,40 @@ class Client(object):
             if result.asr_result.text != "":
                 return result.asr_result
 
-    def write_tts_audio(self, token, reply_action, writer):
+    def write_tts_audio(self, token, reply_action, writer, metrics=None):
         """Convenience function to create a TTS stream and send the audio
         to the given writer. This function blocks until there is no more
-        audio to receive."""
+        audio to receive. If a metrics.Recorder is given, the timing of
+        the request is recorded."""
         # Check if we have a text or byte writer
         is_text = isinstance(writer, io.TextIOBase)
 
+        request_metrics = None
+        if metrics is not None:
+            request_metrics = metrics.request(
+                luna_model=reply_action.luna_model,
+                chars=len(reply_action.text))
+
         # Create the stream
         stream = self.new_tts_stream(token, reply_action)
-        for data in stream:
-            if is_text:
-                # Convert the text to a string before writing
-                writer.write(str(data.audio))
-            else:
-                writer.write(data.audio)
+        try:
+            if request_metrics is not None:
+                request_metrics.connected(stream)
+            for data in stream:
+                if request_metrics is not None:
+                    request_metrics.chunk(len(data.audio))
+                if is_text:
+                    # Convert the text to a string before writing
+                    writer.write(str(data.audio))
+                else:
+                    writer.write(data.audio)
+        except Exception as err:
+            if request_metrics is not None:
+                request_metrics.finish(error=err)
+            raise
+
+        if request_metrics is not None:
+            request_metrics.finish()
 
     def read_transcribe_audio(self, transcribe_action, reader, buff_size, callback):
         """Convenience function to create a transcribe stream that reads
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Quantiles reported for each distribution in the Prometheus export
+quantiles = (0.5, 0.9, 0.99)
+
+
+def percentile(values, q):
+    """Returns the q-th quantile (0 to 1) of the given values,
+    interpolating between the closest ranks."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class RequestMetrics(object):
+    """RequestMetrics records the timing of a single TTS request. All
+    times are taken from time.monotonic() and are in seconds from the
+    start of the request. Create it with Recorder.request() just before
+    the request is made, call connected() with the gRPC call, chunk() for
+    each chunk of audio received, and finish() once it has played."""
+
+    def __init__(self, recorder, labels):
+        self.recorder = recorder
+        self.labels = labels
+        self.start = time.monotonic()
+        self.connect_time = None
+        self.first_chunk = None
+        self.gaps = []
+        self.chunks = 0
+        self.audio_bytes = 0
+        self.synthesis_time = None
+        self.underruns = 0
+        self.error = None
+        self._last = None
+
+    def connected(self, call):
+        """Waits for the server's response headers on the given gRPC call
+        and records the connect time. Calls that don't expose their
+        headers (such as wrapped or cached streams) are ignored, and the
+        connect time is left unset."""
+        initial_metadata = getattr(call, "initial_metadata", None)
+        if initial_metadata is None:
+            return
+        initial_metadata()
+        self.connect_time = time.monotonic() - self.start
+
+    def chunk(self, size):
+        """Records the arrival of a chunk of size bytes of audio."""
+        now = time.monotonic()
+        if self._last is None:
+            self.first_chunk = now - self.start
+        else:
+            self.gaps.append(now - self._last)
+        self._last = now
+        self.chunks += 1
+        self.audio_bytes += size
+
+    def measure(self, chunks):
+        """Yields the given chunks of audio, recording the arrival of each
+        one."""
+        for chunk in chunks:
+            self.chunk(len(chunk))
+            yield chunk
+
+    @property
+    def audio_seconds(self):
+        return self.audio_bytes / float(self.recorder.bytes_per_second)
+
+    @property
+    def rtf(self):
+        """Returns the real-time factor: seconds of audio synthesized per
+        second of synthesis time (higher is faster)."""
+        if not self.synthesis_time:
+            return None
+        return self.audio_seconds / self.synthesis_time
+
+    def finish(self, underruns=0, error=None):
+        """Marks the request as complete and adds it to the recorder. The
+        synthesis time runs until the last chunk was received."""
+        end = self._last if self._last is not None else time.monotonic()
+        self.synthesis_time = end - self.start
+        self.underruns = underruns
+        self.error = error
+        self.recorder.add(self)
+
+    def to_dict(self):
+        d = dict(self.labels)
+        d.update({
+            "connect_s": self.connect_time,
+            "first_chunk_s": self.first_chunk,
+            "synthesis_s": self.synthesis_time,
+            "chunks": self.chunks,
+            "audio_s": self.audio_seconds,
+            "rtf": self.rtf,
+            "gap_p50_s": percentile(self.gaps, 0.5),
+            "gap_p99_s": percentile(self.gaps, 0.99),
+            "gap_max_s": max(self.gaps) if self.gaps else 0.0,
+            "underruns": self.underruns,
+        })
+        if self.error is not None:
+            d["error"] = str(self.error)
+        return d
+
+
+class Recorder(object):
+    """Recorder collects the metrics of completed TTS requests. Each
+    request is appended to jsonl_path (if given) as a JSON line as soon
+    as it finishes, and the totals and latency distributions over all
+    requests are rewritten to prometheus_path (if given) in the
+    Prometheus text format, e.g. for the node exporter's textfile
+    collector. sample_rate, sample_width and channels describe the
+    synthesized audio and are used to compute audio durations."""
+
+    def __init__(self, sample_rate, sample_width=2, channels=1,
+                 jsonl_path=None, prometheus_path=None):
+        self.bytes_per_second = sample_rate * sample_width * channels
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.requests = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.underruns = 0
+        self.connect_times = []
+        self.first_chunks = []
+        self.gaps = []
+        self.rtfs = []
+        self._lock = threading.RLock()
+
+    def request(self, **labels):
+        """Returns a RequestMetrics for a new request. The labels are
+        included in its JSON line."""
+        return RequestMetrics(self, labels)
+
+    def add(self, m):
+        with self._lock:
+            self.requests += 1
+            if m.error is not None:
+                self.failed += 1
+            self.audio_seconds += m.audio_seconds
+            self.underruns += m.underruns
+            if m.connect_time is not None:
+                self.connect_times.append(m.connect_time)
+            if m.first_chunk is not None:
+                self.first_chunks.append(m.first_chunk)
+            self.gaps.extend(m.gaps)
+            if m.rtf is not None:
+                self.rtfs.append(m.rtf)
+
+            if self.jsonl_path is not None:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(m.to_dict()) + "\n")
+            if self.prometheus_path is not None:
+                self._write_prometheus()
+
+    def prometheus(self):
+        """Returns the collected metrics in the Prometheus text format."""
+        lines = []
+
+        def counter(name, help_text, value):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("{} {}".format(name, value))
+
+        def summary(name, help_text, values):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} summary".format(name))
+            for q in quantiles:
+                lines.append('{}{{quantile="{}"}} {}'.format(
+                    name, q, percentile(values, q)))
+            lines.append("{}_sum {}".format(name, sum(values)))
+            lines.append("{}_count {}".format(name, len(values)))
+
+        with self._lock:
+            counter("tts_requests_total", "TTS requests completed.",
+                    self.requests)
+            counter("tts_requests_failed_total", "TTS requests that failed.",
+                    self.failed)
+            counter("tts_audio_seconds_total", "Seconds of audio synthesized.",
+                    self.audio_seconds)
+            counter("tts_playback_underruns_total",
+                    "Times playback ran out of audio mid-utterance.",
+                    self.underruns)
+            summary("tts_connect_seconds",
+                    "Time until the server's response headers arrived.",
+                    self.connect_times)
+            summary("tts_first_chunk_seconds",
+                    "Time until the first chunk of audio arrived.",
+                    self.first_chunks)
+            summary("tts_chunk_gap_seconds",
+                    "Time between consecutive chunks of audio.", self.gaps)
+            summary("tts_real_time_factor",
+                    "Seconds of audio synthesized per second of synthesis.",
+                    self.rtfs)
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self):
+        # Write to a temporary file and rename it, so that a scraper never
+        # reads a partial file
+        text = self.prometheus()
+        directory = os.path.dirname(self.prometheus_path) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.prometheus_path)
+
+    def summary(self):
+        return ("{} TTS requests ({} failed), connect p50 {:.1f} ms, "
+                "first chunk p50 {:.1f} ms p99 {:.1f} ms, chunk gap p99 "
+                "{:.1f} ms, real-time factor p50 {:.1f}, {} underruns").format(
+                    self.requests, self.failed,
+                    percentile(self.connect_times, 0.5) * 1000,
+                    percentile(self.first_chunks, 0.5) * 1000,
+                    percentile(self.first_chunks, 0.99) * 1000,
+                    percentile(self.gaps, 0.99) * 1000,
+                    percentile(self.rtfs, 0.5), self.underruns)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+
+
+class PrefetchedReply(object):
+    """PrefetchedReply is the TTS audio of a reply action being fetched in
+    the background by a TTSPrefetcher. Iterating over it yields the audio
+    chunks in order, waiting for chunks that haven't arrived yet. Errors
+    from the TTS stream are raised by the iteration. If the prefetcher has
+    a metrics recorder, metrics is the metrics.RequestMetrics of the TTS
+    request, which records chunks as they arrive from the server; it is
+    left for the player to finish."""
+
+    def __init__(self, prefetcher, reply):
+        self.reply = reply
+        self.playing = False
+        self._prefetcher = prefetcher
+        self._chunks = collections.deque()
+        self._done = False
+        self._error = None
+        self._call = None
+        self.metrics = None
+
+    def __iter__(self):
+        cond = self._prefetcher._cond
+        with cond:
+            # The reply being played is no longer subject to the memory
+            # cap, so it can never be stuck behind later replies.
+            self.playing = True
+            cond.notify_all()
+        while True:
+            with cond:
+                cond.wait_for(lambda: self._chunks or self._done)
+                if self._chunks:
+                    chunk = self._chunks.popleft()
+                    self._prefetcher.buffered -= len(chunk)
+                    cond.notify_all()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield chunk
+
+    def cancel(self):
+        """Stops fetching the audio and discards what was buffered. An
+        iteration in progress raises an error, so incomplete audio can't
+        be mistaken for the whole reply."""
+        cond = self._prefetcher._cond
+        with cond:
+            if self._call is not None and not self._done:
+                self._call.cancel()
+            self._done = True
+            self._error = RuntimeError("reply audio was cancelled")
+            self._prefetcher.buffered -= sum(len(c) for c in self._chunks)
+            self._chunks.clear()
+            cond.notify_all()
+
+
+class TTSPrefetcher(object):
+    """TTSPrefetcher starts the TTS streams of reply actions in the
+    background, so that when a session returns several replies, later
+    replies are synthesized while earlier ones play. Audio is buffered in
+    memory; once max_bytes are buffered, replies that aren't being played
+    stop reading from their streams until there is room again. If a
+    metrics.Recorder is given, each TTS request is timed from the moment
+    it is made, rather than from when its reply starts playing."""
+
+    def __init__(self, client, token, max_bytes=4 * 1024 * 1024,
+                 metrics=None):
+        self.client = client
+        self.token = token
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.buffered = 0
+        self._cond = threading.Condition()
+        self._replies = []
+
+    def start(self, reply):
+        """Starts fetching the audio for the given reply action and
+        returns a PrefetchedReply for it."""
+        prefetched = PrefetchedReply(self, reply)
+        if self.metrics is not None:
+            prefetched.metrics = self.metrics.request(
+                luna_model=reply.luna_model, chars=len(reply.text),
+                source="prefetch")
+        self._replies.append(prefetched)
+        threading.Thread(target=self._fetch, args=(prefetched,),
+                         daemon=True).start()
+        return prefetched
+
+    def _fetch(self, prefetched):
+        try:
+            call = self.client.new_tts_stream(self.token, prefetched.reply)
+            with self._cond:
+                prefetched._call = call
+                if prefetched._done:
+                    call.cancel()
+                    return
+            if prefetched.metrics is not None:
+                prefetched.metrics.connected(call)
+            for data in call:
+                if prefetched.metrics is not None:
+                    prefetched.metrics.chunk(len(data.audio))
+                with self._cond:
+                    self._cond.wait_for(lambda: prefetched.playing or
+                                        prefetched._done or
+                                        self.buffered < self.max_bytes)
+                    if prefetched._done:
+                        return
+                    prefetched._chunks.append(data.audio)
+                    self.buffered += len(data.audio)
+                    self._cond.notify_all()
+        except Exception as err:
+            with self._cond:
+                if not prefetched._done:
+                    prefetched._error = err
+        finally:
+            with self._cond:
+                prefetched._done = True
+                self._cond.notify_all()
+
+    def close(self):
+        """Cancels the replies that are still being fetched."""
+        for prefetched in self._replies:
+            prefetched.cancel()
+        self._replies = []
@@ -16,15 +16,169 @@
 
 from cobaltspeech.diatheke.v3.diatheke_pb2 import StreamASRRequest, TranscribeRequest
 from queue import Queue
+import collections
 import threading
+import time
 import io
 
+# Policies for sending audio when a stream's send queue is full
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+
+
+class SendQueue(object):
+    """SendQueue passes requests from the thread sending audio to the
+    thread running a gRPC stream. It holds up to depth entries. Audio is
+    queued as raw bytes and only wrapped in a request message by the gRPC
+    thread, which lets adjacent audio be merged. The audio is copied when
+    it is queued (unless it is already an immutable bytes object), so
+    callers may reuse their buffers straight away. When the queue is full,
+    the policy decides what happens to new audio:
+
+    BLOCK waits for space, applying backpressure to the sender.
+    DROP_OLDEST discards the oldest queued audio to make room, so a slow
+    network never stalls a capture thread. Dropped writes are counted.
+    COALESCE appends the audio to the newest queued audio, so no audio is
+    lost while the number of queued messages stays bounded. Merged writes
+    are counted.
+
+    Other requests (tokens and actions) are never dropped or merged; they
+    wait for space under every policy.
+
+    Coalescing of small writes can also be enabled with coalesce_bytes.
+    The gRPC thread then merges queued audio into messages of up to that
+    many bytes, waiting up to coalesce_ms after the first write of a
+    message for more audio to arrive. This trades a little latency for
+    far fewer messages when audio is sent in small frames. The number of
+    writes that didn't need a message of their own is counted in
+    messages_saved."""
+
+    def __init__(self, depth=32, policy=BLOCK, coalesce_bytes=0, coalesce_ms=0):
+        if policy not in (BLOCK, DROP_OLDEST, COALESCE):
+            raise ValueError("unknown send queue policy: {}".format(policy))
+        self.depth = max(1, depth)
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_ms / 1000.0
+        self.messages_saved = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _wait_for_space(self):
+        # Returns False if the queue was closed while waiting
+        self._cond.wait_for(lambda: self._closed or len(self._items) < self.depth)
+        return not self._closed
+
+    def put(self, request):
+        """Queues a request that isn't audio. Returns False if the queue
+        has been closed."""
+        with self._cond:
+            if not self._wait_for_space():
+                return False
+            self._items.append((False, request))
+            self._cond.notify_all()
+            return True
+
+    def put_audio(self, data):
+        """Queues audio data, applying the policy if the queue is full.
+        Returns False if the queue has been closed."""
+        # Take a private copy, so that a reused capture buffer isn't
+        # overwritten while it is queued and coalescing never modifies the
+        # caller's data. bytes() doesn't copy data that is already bytes.
+        data = bytes(data)
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.depth:
+                if self.policy == COALESCE and self._items[-1][0]:
+                    queued, tail = self._items[-1][1:]
+                    if not isinstance(tail, bytearray):
+                        tail = bytearray(tail)
+                        self._items[-1] = (True, queued, tail)
+                    tail += data
+                    self.coalesced += 1
+                    return True
+                if self.policy == DROP_OLDEST:
+                    oldest = next((i for i, item in enumerate(self._items)
+                                   if item[0]), None)
+                    if oldest is not None:
+                        del self._items[oldest]
+                        self.dropped += 1
+                if not self._wait_for_space():
+                    return False
+            self._items.append((True, time.monotonic(), data))
+            self._cond.notify_all()
+            return True
+
+    def finish(self):
+        """Queues the end of the stream. This never blocks."""
+        with self._cond:
+            self._items.append(None)
+            self._cond.notify_all()
+
+    def get(self):
+        """Waits for the next entry. Returns a tuple of a flag that is True
+        for audio and the audio bytes or request, or None at the end of the
+        stream."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            if item is not None and item[0]:
+                item = (True, self._merge(item[1], item[2]))
+            self._cond.notify_all()
+            return item
+
+    def _merge(self, queued, data):
+        # Appends the audio that follows data in the queue, up to
+        # coalesce_bytes, waiting until coalesce_delay after the first
+        # write was queued for more to arrive. Called with the lock held.
+        deadline = queued + self.coalesce_delay
+        while len(data) < self.coalesce_bytes:
+            if self._items:
+                item = self._items[0]
+                if item is None or not item[0] or \
+                        len(data) + len(item[2]) > self.coalesce_bytes:
+                    break
+                self._items.popleft()
+                if not isinstance(data, bytearray):
+                    data = bytearray(data)
+                data += item[2]
+                self.messages_saved += 1
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closed:
+                break
+            self._cond.wait(remaining)
+        return data
+
+    def close(self):
+        """Closes the queue once the stream has finished. Blocked senders
+        return immediately, and queued entries are discarded."""
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
 
 class ASRStream(object):
     """ASRStream represents a stream of audio data sent from the client
-    to Diatheke for speech recognition in the context of a session."""
+    to Diatheke for speech recognition in the context of a session.
+
+    Up to queue_depth requests are buffered between send_audio() and the
+    network, and policy (BLOCK, DROP_OLDEST or COALESCE) decides what
+    send_audio() does when the buffer is full. Small writes are merged
+    into messages of up to coalesce_bytes, waiting at most coalesce_ms,
+    if coalesce_bytes is set. See SendQueue. The queue is available as
+    the queue attribute, e.g. to check its counters."""
 
-    def __init__(self, client_stub):
+    def __init__(self, client_stub, queue_depth=32, policy=BLOCK,
+                 coalesce_bytes=0, coalesce_ms=0):
         # The Python implementation of gRPC is a little different from other
         # languages. Rather than having send and receive methods for the stream,
         # request streams in Python take an iterator or generator function. This
@@ -34,11 +188,12 @@ class ASRStream(object):
 
         # Set up a queue to transfer data from the write function to the
         # __next__ function.
-        self._data_queue = Queue(maxsize=1)
+        self.queue = SendQueue(queue_depth, policy, coalesce_bytes, coalesce_ms)
 
-        # Set up a lock and variable to handle checking whether a result is
-        # available or not.
-        self._lock = threading.Lock()
+        # Set up an event to check whether a result is available. Checking
+        # it doesn't take the queue's lock, although queuing the audio
+        # itself still does.
+        self._done = threading.Event()
         self._result = None
 
         # They way client gRPC streaming works in Python is that the streaming
@@ -61,28 +216,27 @@ class ASRStream(object):
 
         # Wait for data from the queue. The queue will block until
         # data is available.
-        request = self._data_queue.get()
-        if request is None:
+        item = self.queue.get()
+        if item is None:
             # This is our sentinel to indicate the iterator should finish,
-            # which is done by raising the StopIteration exception. A side
-            # effect of this is that if a user sends 'None' to one of the
-            # send functions, it will also end the stream.
+            # which is done by raising the StopIteration exception.
             raise StopIteration
 
-        return request
+        is_audio, data = item
+        if is_audio:
+            return StreamASRRequest(audio=bytes(data))
+        return data
 
     def _run_stream(self, client_stub):
         # Give the stream as the iterable the gRPC function requires.
-        result = client_stub.StreamASR(self)
-        self._set_result(result)
+        try:
+            self._result = client_stub.StreamASR(self)
+        finally:
+            self._done.set()
+            self.queue.close()
 
     def _has_result(self):
-        with self._lock:
-            return self._result != None
-
-    def _set_result(self, result):
-        with self._lock:
-            self._result = result
+        return self._done.is_set()
 
     def send_audio(self, audio_bytes):
         """Send the given audio bytes to Diatheke for transcription.
@@ -93,10 +247,8 @@ class ASRStream(object):
         if self._has_result():
             return False
 
-        # Send the request
-        req = StreamASRRequest(audio=audio_bytes)
-        self._data_queue.put(req)
-        return True
+        # Send the audio
+        return self.queue.put_audio(audio_bytes)
 
     def send_token(self, token):
         """Send the given session token to Diatheke to update the
@@ -112,9 +264,7 @@ class ASRStream(object):
             return False
 
         # Send the request
-        req = StreamASRRequest(token=token)
-        self._data_queue.put(req)
-        return True
+        return self.queue.put(StreamASRRequest(token=token))
 
     def result(self):
         """Returns the result of speech recognition. This function may
@@ -124,7 +274,7 @@ class ASRStream(object):
         # Check if the stream has already returned a result. If not,
         # force it to stop by sending our sentinel iterator value.
         if not self._has_result():
-            self._data_queue.put(None)
+            self.queue.finish()
 
         # Wait for the streaming thread to finish and return the result.
         self._stream_thread.join()
@@ -137,9 +287,13 @@ class TranscribeStream(object):
     differs from an ASRStream in purpose - where ASRStream accepts audio
     to continue a conversation with the system, TranscribeStream accepts
     audio solely for the purpose of getting a transcription that the client
-    can use for any purpose (e.g., note taking, send a message, etc.)."""
+    can use for any purpose (e.g., note taking, send a message, etc.).
+
+    Requests and results are buffered up to queue_depth deep. The policy
+    and coalescing options apply to send_audio() as for ASRStream."""
 
-    def __init__(self, client_stub):
+    def __init__(self, client_stub, queue_depth=32, policy=BLOCK,
+                 coalesce_bytes=0, coalesce_ms=0):
         # The Python implementation of gRPC is a little different from
         # other languages. Rather than having send and receive methods
         # for the stream, the bidirectional stream takes an iterator or
@@ -148,63 +302,50 @@ class TranscribeStream(object):
         # use our own stream class with some threading to make this work.
 
         # Set up queues to transfer data
-        input = Queue(maxsize=1)
-        output = Queue(maxsize=1)
-        self._input_queue = input
+        input = SendQueue(queue_depth, policy, coalesce_bytes, coalesce_ms)
+        output = Queue(maxsize=max(1, queue_depth))
+        self.queue = input
         self._output_queue = output
 
-        # Use a flag (and lock) to indicate when the stream is closed.
-        lock = threading.Lock()
-        doneFlag = False
-
-        def is_done():
-            nonlocal doneFlag
-            with lock:
-                if doneFlag:
-                    return True
-                return False
-        self._is_done = is_done
+        # Use an event to indicate when the stream is closed.
+        done = threading.Event()
+        self._is_done = done.is_set
 
         # Generator function to pass data from the input queue to the
         # streaming method.
         def wait_for_audio():
-            while not is_done():
+            while not done.is_set():
                 # Wait for data from the queue, which will block until data
                 # is available.
-                request = input.get()
-                if request is None:
+                item = input.get()
+                if item is None:
                     # This is our sentinel to indicate that the generator
                     # should finish, which will end the stream.
                     return None
 
-                yield request
+                is_audio, data = item
+                if is_audio:
+                    yield TranscribeRequest(audio=bytes(data))
+                else:
+                    yield data
 
         # Function to run the gRPC method.
         def run_stream():
-            nonlocal doneFlag
-            for result in client_stub.Transcribe(wait_for_audio()):
-                output.put(result)
-
-            # Set the done flag
-            with lock:
-                doneFlag = True
+            try:
+                for result in client_stub.Transcribe(wait_for_audio()):
+                    output.put(result)
+            finally:
+                # Set the done flag
+                done.set()
+                input.close()
 
-            # Send None on the output to indicate the stream has finished.
-            output.put(None)
+                # Send None on the output to indicate the stream has finished.
+                output.put(None)
 
         # Start the stream on its own thread.
         self._stream_thread = threading.Thread(target=run_stream)
         self._stream_thread.start()
 
-    def _send(self, request):
-        # Check if the stream has closed.
-        if self._is_done():
-            return False
-
-        # Send the request to the streaming thread.
-        self._input_queue.put(request)
-        return True
-
     def send_action(self, action):
         """Send the given TranscribeAction to Diatheke to update the speech
         recognition context. The action must first be sent on the stream
@@ -214,7 +355,9 @@ class TranscribeStream(object):
         If this function returns False, the server has closed the stream, and
         no further attempts should be made to send an action or audio data to
         the server."""
-        return self._send(TranscribeRequest(action=action))
+        if self._is_done():
+            return False
+        return self.queue.put(TranscribeRequest(action=action))
 
     def send_audio(self, audio_bytes):
         """Send the given audio data to Diatheke for transcription.
@@ -225,13 +368,16 @@ class TranscribeStream(object):
 
         It is thread-safe to call this method while also calling
         receive_result()."""
-        return self._send(TranscribeRequest(audio=audio_bytes))
+        if self._is_done():
+            return False
+        return self.queue.put_audio(audio_bytes)
 
     def send_finished(self):
         """Tell the server that no more data will be sent over this stream.
         It is an error to call send_audio() or send_action() after calling
         this."""
-        self._send(None)
+        if not self._is_done():
+            self.queue.finish()
 
     def receive_result(self):
         """Wait for the next available TranscribeResult from the server.
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+import numpy as np
+
+
+def frame_features(frame):
+    """Returns the energy (in dB relative to full scale) and the zero
+    crossing rate (crossings per sample) of a frame of 16-bit signed
+    little-endian PCM audio."""
+    samples = np.frombuffer(frame, dtype="<i2")
+    if samples.size == 0:
+        return -np.inf, 0.0
+    x = samples.astype(np.float32)
+    power = np.mean(x * x) / (32768.0 * 32768.0)
+    energy = 10.0 * np.log10(power) if power > 0 else -np.inf
+    crossings = np.count_nonzero(np.signbit(samples[1:]) != np.signbit(samples[:-1]))
+    return energy, crossings / float(samples.size)
+
+
+class VAD(object):
+    """VAD is a simple voice activity detector for 16-bit PCM audio. A
+    frame is speech if its energy is at least energy_threshold dBFS, or
+    if it is within weak_margin dB of the threshold and its zero crossing
+    rate is at least zcr_threshold (quiet, noise-like consonants such as
+    "s" and "f"). Frames are expected to be frame_ms milliseconds long.
+
+    process() is called with each frame of audio and returns the frames
+    that should be sent upstream. Speech only starts after min_speech_ms
+    of consecutive speech frames, so a click or a cough doesn't start an
+    utterance. Leading silence is dropped, except for the last
+    preroll_ms, which is sent along with the frames that started the
+    speech so the onset of the utterance isn't clipped. After speech, frames
+    keep being sent for hangover_ms, and the end of the utterance is
+    signalled once end_silence_ms of silence has been seen. Silence
+    after the hangover is dropped."""
+
+    def __init__(self, frame_ms=20, energy_threshold=-45.0,
+                 weak_margin=10.0, zcr_threshold=0.3, preroll_ms=200,
+                 hangover_ms=300, end_silence_ms=800, min_speech_ms=100):
+        self.energy_threshold = energy_threshold
+        self.weak_margin = weak_margin
+        self.zcr_threshold = zcr_threshold
+        self.hangover_frames = max(0, hangover_ms // frame_ms)
+        self.end_frames = max(1, end_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+
+        # Frames that may start the speech wait in the pre-roll too, so it
+        # holds at least min_speech_frames - 1 frames
+        self._preroll = collections.deque(maxlen=max(
+            preroll_ms // frame_ms, self.min_speech_frames - 1))
+        self.frames = 0
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        """Prepares for a new utterance. The frame counts are kept."""
+        self.in_speech = False
+        self.ended = False
+        self._silence = 0
+        self._voiced = 0
+        self.dropped += len(self._preroll)
+        self._preroll.clear()
+
+    def is_speech(self, frame):
+        """Returns True if the given frame contains speech."""
+        energy, zcr = frame_features(frame)
+        if energy >= self.energy_threshold:
+            return True
+        return energy >= self.energy_threshold - self.weak_margin and \
+            zcr >= self.zcr_threshold
+
+    def process(self, frame):
+        """Processes the next frame of audio and returns the list of
+        frames (possibly empty) to send. Check the ended attribute
+        afterwards to find out whether the utterance is over."""
+        self.frames += 1
+        frame = bytes(frame)
+        if self.ended:
+            self.dropped += 1
+            return []
+
+        speech = self.is_speech(frame)
+        if speech and self.in_speech:
+            self._silence = 0
+            return [frame]
+
+        if speech:
+            self._voiced += 1
+            if self._voiced >= self.min_speech_frames:
+                # Start of speech: send the pre-roll (which includes the
+                # earlier speech frames) with this frame
+                self.in_speech = True
+                out = list(self._preroll)
+                self._preroll.clear()
+                out.append(frame)
+                return out
+        else:
+            self._voiced = 0
+
+        if not self.in_speech:
+            # Audio before the speech starts is kept only as pre-roll; the
+            # oldest frame falls out of it once it is full
+            if len(self._preroll) == self._preroll.maxlen:
+                self.dropped += 1
+            if self._preroll.maxlen:
+                self._preroll.append(frame)
+            return []
+
+        self._silence += 1
+        if self._silence >= self.end_frames:
+            self.ended = True
+        if self._silence <= self.hangover_frames:
+            return [frame]
+        self.dropped += 1
+        return []
+
+
+class VADReader(object):
+    """VADReader wraps an audio reader (such as a Recorder) that returns
+    frames of 16-bit PCM audio from read(), and returns only the frames
+    the VAD selects. It returns an empty bytes object once the VAD
+    detects the end of the utterance, or when the wrapped reader does.
+    Call reset() to start reading the next utterance."""
+
+    def __init__(self, reader, vad):
+        self.reader = reader
+        self.vad = vad
+        self.eof = False
+        self._pending = collections.deque()
+
+    def reset(self):
+        """Prepares to read the next utterance."""
+        self.vad.reset()
+        self._pending.clear()
+
+    def read(self, size=None):
+        """Returns the next frame to send. The size argument is passed
+        on to the wrapped reader."""
+        while not self._pending:
+            if self.vad.ended or self.eof:
+                return b""
+            frame = self.reader.read(size)
+            if not frame:
+                self.eof = True
+                return b""
+            self._pending.extend(self.vad.process(frame))
+        return self._pending.popleft()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (2020 -- present) Cobalt Speech and Language, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import abc
+import collections
+
+import numpy as np
+
+
+class KeywordSpotter(abc.ABC):
+    """KeywordSpotter is the abstract base class of local wake-word
+    detectors. The spotter is given each frame of 16-bit PCM audio in turn
+    and returns True from process() once the wake-word has been heard.
+    Subclasses must implement process(), and may override reset()."""
+
+    def reset(self):
+        """Prepares to listen for the next wake-word."""
+
+    @abc.abstractmethod
+    def process(self, frame):
+        """Processes the next frame of audio. Returns True if the
+        wake-word ends with this frame."""
+
+
+class EnergySpotter(KeywordSpotter):
+    """EnergySpotter is a minimal reference spotter that triggers on any
+    burst of speech at least min_speech_ms long, as judged by the given
+    VAD. It doesn't recognize a particular word, but it keeps silence and
+    background noise from being streamed to the server."""
+
+    def __init__(self, detector, frame_ms=20, min_speech_ms=200):
+        self.detector = detector
+        self.min_frames = max(1, min_speech_ms // frame_ms)
+        self.reset()
+
+    def reset(self):
+        self._speech = 0
+
+    def process(self, frame):
+        if self.detector.is_speech(frame):
+            self._speech += 1
+        else:
+            self._speech = 0
+        return self._speech >= self.min_frames
+
+
+def band_energies(frame, bands=16, dynamic_range=5.0):
+    """Returns the log energies of the given frame of 16-bit PCM audio
+    in equal-width frequency bands, with their mean removed so that the
+    features don't depend on the loudness of the speaker. Bands more than
+    dynamic_range (in natural log units) below the loudest are clamped,
+    so that background noise doesn't dominate the comparison."""
+    x = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(x * np.hanning(x.size))) ** 2
+    edges = np.linspace(1, spectrum.size, bands + 1).astype(int)
+    energies = np.log(np.add.reduceat(spectrum, edges[:-1]) + 1e-3)
+    energies = np.maximum(energies, energies.max() - dynamic_range)
+    return energies - energies.mean()
+
+
+class TemplateSpotter(KeywordSpotter):
+    """TemplateSpotter detects a wake-word by comparing the incoming audio
+    to a recording of it (the template) using dynamic time warping over
+    band log-energy features. The template should be 16-bit PCM audio at
+    the recording sample rate, trimmed to the wake-word itself.
+
+    Matching is done incrementally, one frame at a time, with vectorized
+    NumPy: for each template frame, the spotter keeps the cost of the best
+    alignment of the template so far ending at the current frame, which
+    allows the spoken word to be up to twice as fast or arbitrarily slower
+    than the template. The spotter triggers when the average per-frame
+    distance of a full alignment falls below threshold."""
+
+    def __init__(self, template, frame_bytes, threshold=0.6, bands=16):
+        self.threshold = threshold
+        self.bands = bands
+        count = len(template) // frame_bytes
+        if count < 2:
+            raise ValueError("wake-word template is too short")
+        self.template = np.array([
+            band_energies(template[i * frame_bytes:(i + 1) * frame_bytes], bands)
+            for i in range(count)])
+        self.score = np.inf
+        self.reset()
+
+    def reset(self):
+        n = len(self.template)
+        self._cost = np.full(n, np.inf)
+        self._length = np.ones(n)
+
+    def process(self, frame):
+        dist = np.sqrt(np.sum((self.template - band_energies(frame, self.bands)) ** 2,
+                              axis=1))
+
+        # Each template frame may be reached from the same template frame
+        # (the word is spoken more slowly), the previous one, or the one
+        # before that (spoken faster). Paths are compared by their average
+        # distance per frame.
+        n = len(dist)
+        cost = np.full((3, n), np.inf)
+        length = np.ones((3, n))
+        cost[0], length[0] = self._cost, self._length
+        cost[1, 1:], length[1, 1:] = self._cost[:-1], self._length[:-1]
+        cost[2, 2:], length[2, 2:] = self._cost[:-2], self._length[:-2]
+
+        # A match may start at any frame
+        cost[1, 0], length[1, 0] = 0.0, 0.0
+
+        best = np.argmin(cost / np.maximum(length, 1.0), axis=0)
+        cols = np.arange(n)
+        self._cost = cost[best, cols] + dist
+        self._length = length[best, cols] + 1
+
+        self.score = self._cost[-1] / self._length[-1]
+        if self.score < self.threshold:
+            self.reset()
+            return True
+        return False
+
+
+def load_template(path, frame_bytes, threshold=0.6):
+    """Returns a TemplateSpotter for the raw 16-bit PCM audio in the
+    given file."""
+    with open(path, "rb") as f:
+        return TemplateSpotter(f.read(), frame_bytes, threshold)
+
+
+class PrerollReader(object):
+    """PrerollReader returns the given frames of audio before reading
+    from the wrapped reader, so audio held back while waiting for the
+    wake-word can still be sent to the server."""
+
+    def __init__(self, frames, reader):
+        self.frames = collections.deque(frames)
+        self.reader = reader
+
+    def read(self, size=None):
+        if self.frames:
+            return self.frames.popleft()
+        return self.reader.read(size)
+
+
+def wait_for_wake_word(reader, spotter, preroll_frames=100):
+    """Reads frames from the given reader until the spotter triggers.
+    Nothing is sent anywhere while waiting. Returns a PrerollReader that
+    replays the last preroll_frames frames (which include the wake-word)
+    and then continues with the reader, or None if the reader reached the
+    end of its audio first. The number of frames held back is stored in
+    the held attribute of the returned reader."""
+    spotter.reset()
+    preroll = collections.deque(maxlen=preroll_frames)
+    held = 0
+    while True:
+        frame = reader.read()
+        if not frame:
+            return None
+        held += 1
+        preroll.append(frame)
+        if spotter.process(frame):
+            out = PrerollReader(preroll, reader)
+            out.held = held
+            return out
@@ -15,6 +15,8 @@
 # limitations under the License.
 
 import subprocess
+import threading
+import time
 
 
 class Player(object):
@@ -58,3 +60,220 @@ class Player(object):
 
         # Write the audio data to the external application's stdin.
         self.process.stdin.write(audio)
+
+
+class ProcessOutput(object):
+    """ProcessOutput plays audio through an external application, such
+    as sox or aplay, that reads audio data from stdin. The application is
+    started once and kept running for as long as the output is open."""
+
+    def __init__(self, cmd):
+        self.args = cmd.split()
+        self.process = None
+
+    def open(self):
+        """Start the external playback application."""
+        self.process = subprocess.Popen(args=self.args,
+                                        stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def close(self):
+        """Stop the external playback application."""
+        self.process.stdin.close()
+        self.process.wait()
+        self.process = None
+
+
+class FileOutput(object):
+    """FileOutput writes the played audio to a raw audio file, for
+    benchmarking or testing without a sound card."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self):
+        """Open the file."""
+        self._file = open(self.path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+
+class NullOutput(object):
+    """NullOutput discards the played audio, for benchmarking without a
+    sound card."""
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def playback_backend(target, cmd):
+    """Returns a playback output for the given target: "process" runs cmd
+    and keeps it running between utterances, "null" discards the audio,
+    and any other value is the path of a raw audio file to write."""
+    if target == "process":
+        return ProcessOutput(cmd)
+    if target == "null":
+        return NullOutput()
+    return FileOutput(target)
+
+
+class PlaybackSink(object):
+    """PlaybackSink is a long-lived audio player that accepts successive
+    utterances. Audio written to the sink is played on a background thread
+    through an output backend (by default a ProcessOutput running cmd),
+    which stays open until the sink is closed.
+
+    The sink is paced by the playback clock, computed from the sample
+    rate, sample width (bytes) and channel count of the audio. Each
+    utterance starts playing once prebuffer_ms of audio has been buffered,
+    which absorbs jitter in the arrival of network audio, and the output
+    is kept at most prebuffer_ms ahead of the clock so that flush() can
+    stop playback promptly. If the buffer runs dry before the end of an
+    utterance, an underrun is counted and the sink prebuffers again."""
+
+    def __init__(self, cmd=None, sample_rate=16000, sample_width=2,
+                 channels=1, prebuffer_ms=100, period_ms=20, output=None):
+        if output is None:
+            output = ProcessOutput(cmd)
+        self.output = output
+        self.bytes_per_second = sample_rate * sample_width * channels
+        frame = sample_width * channels
+        self.prebuffer_bytes = self.bytes_per_second * prebuffer_ms // 1000 // frame * frame
+        self.period_bytes = max(frame, self.bytes_per_second * period_ms // 1000 // frame * frame)
+        self.underruns = 0
+        self.bytes_played = 0
+
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._active = False      # an utterance is in progress
+        self._ended = True        # no more audio for the current utterance
+        self._prebuffering = True
+        self._play_until = 0.0    # when the audio written so far finishes
+        self._closed = False
+
+        self.output.open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        lead = self.prebuffer_bytes / float(self.bytes_per_second)
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    if self._prebuffering and (
+                            len(self._buf) >= self.prebuffer_bytes or
+                            (self._ended and self._buf)):
+                        self._prebuffering = False
+                    if self._buf and not self._prebuffering:
+                        if self._play_until - now <= lead:
+                            break
+                        # Keep the output no more than lead seconds ahead
+                        self._cond.wait(self._play_until - now - lead)
+                        continue
+                    if not self._buf and self._active and now >= self._play_until:
+                        if self._ended:
+                            # Everything written has been played
+                            self._active = False
+                            self._cond.notify_all()
+                        elif not self._prebuffering:
+                            # Ran dry in the middle of an utterance
+                            self.underruns += 1
+                            self._prebuffering = True
+                    timeout = None
+                    if self._active and self._play_until > now:
+                        timeout = self._play_until - now
+                    self._cond.wait(timeout)
+
+                chunk = bytes(self._buf[:self.period_bytes])
+                del self._buf[:len(chunk)]
+
+            try:
+                self.output.write(chunk)
+            except (OSError, ValueError):
+                # The output was closed or failed
+                return
+
+            with self._cond:
+                now = time.monotonic()
+                self._play_until = max(self._play_until, now) + \
+                    len(chunk) / float(self.bytes_per_second)
+                self.bytes_played += len(chunk)
+
+    def write(self, audio):
+        """Adds audio data to the current utterance, starting a new one if
+        none is in progress. Audio should be binary data."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Playback sink is closed")
+            if self._ended:
+                self._active = True
+                self._ended = False
+                self._prebuffering = True
+            self._buf += audio
+            self._cond.notify_all()
+
+    def push_audio(self, audio):
+        """Same as write(), for compatibility with Player."""
+        self.write(audio)
+
+    def end(self):
+        """Marks the end of the current utterance, so that the rest of it
+        is played even if it is shorter than the prebuffer."""
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Ends the current utterance and waits until it has been played.
+        Returns False if the timeout expired first."""
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._active or self._closed, timeout)
+
+    def flush(self):
+        """Discards the buffered audio of the current utterance, e.g. when
+        the user barges in. Audio already handed to the output (at most
+        prebuffer_ms) is not recalled."""
+        with self._cond:
+            del self._buf[:]
+            self._ended = True
+            self._active = False
+            self._prebuffering = True
+            self._play_until = min(self._play_until, time.monotonic())
+            self._cond.notify_all()
+
+    def playing(self):
+        """Returns True while an utterance is being played."""
+        with self._cond:
+            return self._active
+
+    def close(self):
+        """Stops playback, discarding any buffered audio, and closes the
+        output."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.output.close()
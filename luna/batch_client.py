@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import csv
+import hashlib
+import os
+import tempfile
+import time
+import wave
+
+import catalog
+import channels
+from luna import luna_pb2 as lunapb
+
+# Connect to the Cobalt demo server (replace value to use a different
+# server, such as "localhost:2727")
+server_address = "demo.cobaltspeech.com:2727"
+
+# TTS voice used for manifest rows that don't name one
+voice_id = "en_US_25"
+
+# How long (in seconds) the server version info and voice list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
+# Manifest of the prompts to render. This is a CSV file (or a TSV file,
+# if the name ends in .tsv) with a header row naming the columns "id",
+# "text" and, optionally, "voice". Each prompt is written to
+# <output_dir>/<id>.wav, so ids may not contain path separators or "..".
+# A hash of the text and voice is kept next to it in <id>.wav.sha256, and
+# prompts whose text or voice has changed are rendered again.
+manifest_path = "./prompts.csv"
+
+# Directory the WAV files are written to
+output_dir = "./prompts"
+
+# Number of prompts to synthesize concurrently. All workers share
+# the same client (and gRPC channel).
+concurrency = 8
+
+
+def read_manifest(path):
+    """Returns the (id, text, voice) rows of the given manifest. voice is
+    None for rows that don't name one."""
+    delimiter = "\t" if path.lower().endswith(".tsv") else ","
+    rows = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            prompt_id = (row.get("id") or "").strip()
+            if prompt_id == "" or prompt_id.startswith("#"):
+                continue
+            rows.append((prompt_id, row.get("text") or "",
+                         (row.get("voice") or "").strip() or None))
+    return rows
+
+
+def check_id(prompt_id):
+    """Raises a ValueError if the prompt id can't safely be used as a file
+    name in the output directory."""
+    separators = [sep for sep in (os.sep, os.altsep, "/") if sep]
+    if prompt_id in ("", ".") or ".." in prompt_id or \
+            any(sep in prompt_id for sep in separators):
+        raise ValueError("invalid prompt id '{}'".format(prompt_id))
+
+
+def prompt_hash(text, voice):
+    """Returns the hash stored alongside a rendered prompt, which changes
+    whenever its text or voice does."""
+    return hashlib.sha256(
+        "{}\0{}".format(voice, text).encode("utf-8")).hexdigest()
+
+
+def is_rendered(path, digest):
+    """Returns True if path was rendered from a prompt with the given
+    hash."""
+    try:
+        with open(path + ".sha256", "r") as f:
+            return f.read().strip() == digest and os.path.exists(path)
+    except OSError:
+        return False
+
+
+def synthesize_to_wav(client, path, text, voice, sample_rate):
+    """Synthesizes the text with the given voice and writes it to path as
+    a 16-bit mono WAV file. The audio is written to a temporary file that
+    is renamed into place when complete, so an interrupted run never
+    leaves a partial file behind. Returns the number of audio samples."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".", suffix=".wav")
+    os.close(fd)
+    try:
+        with wave.open(tmp, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sample_rate)
+            cfg = lunapb.SynthesizerConfig(
+                voice_id=voice,
+                encoding=lunapb.SynthesizerConfig.RAW_LINEAR16
+            )
+            request = lunapb.SynthesizeRequest(config=cfg, text=text)
+            for response in client.SynthesizeStream(request):
+                w.writeframes(response.audio)
+            samples = w.getnframes()
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return samples
+
+
+if __name__ == "__main__":
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    client = channels.client(server_address)
+    channels.pool.warmup(wait=False)
+
+    # Look up the voices (and their sample rates) in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
+    voices = server_info.get(server_address, "voices", lunapb.ListVoicesResponse,
+                             client.ListVoices).voices
+    sample_rates = {v.id: v.sample_rate for v in voices}
+
+    rows = read_manifest(manifest_path)
+    os.makedirs(output_dir, exist_ok=True)
+    print("Rendering {} prompt(s) from '{}' to '{}'\n".format(
+        len(rows), manifest_path, output_dir))
+
+    def render(prompt_id, text, voice):
+        """Renders one prompt. Returns the number of characters and audio
+        seconds synthesized, or None if the prompt was already rendered
+        with the same text and voice."""
+        check_id(prompt_id)
+        path = os.path.join(output_dir, prompt_id + ".wav")
+        voice = voice or voice_id
+        digest = prompt_hash(text, voice)
+        if is_rendered(path, digest):
+            return None
+        if voice not in sample_rates:
+            raise ValueError("unknown voice '{}'".format(voice))
+        samples = synthesize_to_wav(client, path, text, voice,
+                                    sample_rates[voice])
+
+        # Record what was rendered once the audio is in place. If this is
+        # interrupted, the prompt is simply rendered again next time.
+        with open(path + ".sha256", "w") as f:
+            f.write(digest + "\n")
+        return len(text), samples / float(sample_rates[voice])
+
+    start_time = time.time()
+    done = skipped = failed = 0
+    chars = 0
+    audio_seconds = 0.0
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {pool.submit(render, *row): row[0] for row in rows}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as err:
+                failed += 1
+                print("{}: {}".format(futures[future], err))
+                continue
+            if result is None:
+                # Rendered in a previous run
+                skipped += 1
+                continue
+            done += 1
+            chars += result[0]
+            audio_seconds += result[1]
+
+    except KeyboardInterrupt:
+        # stop processing when ctrl+C pressed
+        pass
+    finally:
+        # Don't start any more prompts if we were interrupted
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print("\n{} prompts rendered ({} failed, {} skipped), {} characters, "
+          "{:.1f} audio seconds in {:.1f} seconds".format(
+              done, failed, skipped, chars, audio_seconds, elapsed))
+    print("{:.1f} characters/sec, {:.2f} audio-seconds/sec".format(
+        chars / elapsed, audio_seconds / elapsed))
+    print("Open channels:", channels.pool.open_channels())
@@ -15,8 +15,14 @@
 # limitations under the License.
 
 import audio_io
+import catalog
+import channels
+import contextlib
+import fanout
+import metrics
+import parallel
 import time
-from luna.client import LunaClient
+import tts_cache
 from luna import luna_pb2 as lunapb
 
 # Connect to the Cobalt demo server (replace value to use a different
@@ -27,61 +33,179 @@ server_address = "demo.cobaltspeech.com:2727"
 # ListVoices() method (shown below).
 voice_id = "en_US_25"
 
+# How long (in seconds) the server version info and voice list are
+# cached between runs, so that startup doesn't need extra RPCs. Set
+# refresh_catalog to True to discard the cached entries for this server.
+catalog_ttl = 3600
+refresh_catalog = False
+
 # The external process responsible for playing audio
 play_cmd = "sox -q -c 1 -r 25600 -b 16 -L -e signed -t raw - -d"
 
-def stream_synthesis(text, client, synth_config):
+# Sample rate of the played audio. Must match play_cmd and the voice.
+play_sample_rate = 25600
+
+# Where synthesized audio is played: "process" runs play_cmd once and
+# keeps it running between utterances, "null" discards the audio, and
+# anything else is the path of a raw audio file to write (the last two
+# are useful for benchmarking without a sound card).
+playback_target = "process"
+
+# Audio (in milliseconds) buffered before each utterance starts playing,
+# to absorb jitter in the arrival of synthesized audio
+prebuffer_ms = 100
+
+# Directory of the synthesis cache. Audio is cached by voice, encoding
+# and (whitespace-normalized) text, so repeated phrases are played from
+# disk without contacting the server. Set to None to disable the cache.
+tts_cache_dir = "./tts_cache"
+
+# Maximum size of the synthesis cache, in bytes. The least recently used
+# entries are evicted when the cache grows past this size.
+tts_cache_max_bytes = 256 * 1024 * 1024
+
+# Maximum number of concurrent synthesis requests for long inputs. Text
+# is split at sentence and clause boundaries into segments of at most
+# segment_max_chars characters, which are synthesized in parallel and
+# played in order. Set to 1 to send each input as a single request.
+parallel_requests = 4
+segment_max_chars = 200
+
+# Each utterance's audio is also written to this raw audio file (None to
+# skip it), and, if analyze_audio is True, measured by a level meter.
+# The player, the file and the analyzer are each fed from their own
+# thread through a queue of at most sink_queue_depth chunks, so a slow
+# sink doesn't hold up the synthesis stream.
+raw_output_path = "junk.raw"
+analyze_audio = False
+sink_queue_depth = 32
+
+# Per-request latency metrics (connect time, time to the first chunk,
+# gaps between chunks, real-time factor and playback underruns) are
+# appended to metrics_jsonl as JSON lines, and the totals over the run
+# are written to metrics_prometheus in the Prometheus text format. Set
+# either to None to skip it.
+metrics_jsonl = "./tts_metrics.jsonl"
+metrics_prometheus = None
+
+def stream_synthesis(text, client, synth_config, player, cache=None,
+                     metrics=None):
     """Run the streaming synthesis method for Luna client (i.e., play
-    audio as it is generated)"""
+    audio as it is generated). The player is a PlaybackSink that is
+    reused between calls. If a TTSCache is given, cached audio is played
+    instead of synthesizing the text again, and new audio is cached. If
+    a metrics.Recorder is given, the timing of the request is recorded."""
 
     if text == "":
         return
 
-    start_time = time.time()
+    start_time = time.monotonic()
+    request_metrics = None
+    if metrics is not None:
+        request_metrics = metrics.request(voice=synth_config.voice_id,
+                                          chars=len(text))
+        underruns = player.underruns
 
-    # Set up the playback application
-    player = audio_io.Player(cmd=play_cmd)
-    player.start()
+    # Check the cache before setting up the synthesis stream
+    audio = None
+    synthesis = None
+    if cache is not None:
+        key = tts_cache.cache_key(synth_config.voice_id, synth_config.encoding,
+                                  text)
+        audio = cache.stream(key)
+    if audio is not None:
+        print("Playing cached audio for voice '{}'".format(synth_config.voice_id))
+        if request_metrics is not None:
+            request_metrics.labels["source"] = "cache"
+    else:
+        print("Creating TTS stream using voice '{}'".format(synth_config.voice_id))
+        segments = parallel.split_text(text, segment_max_chars)
+        if parallel_requests > 1 and len(segments) > 1:
+            print("Synthesizing {} segments in parallel".format(len(segments)))
+            synthesis = parallel.ParallelSynthesis(client, synth_config, segments,
+                                                   parallel_requests)
+            audio = iter(synthesis)
+            if request_metrics is not None:
+                request_metrics.labels["source"] = "parallel"
+        else:
+            request = lunapb.SynthesizeRequest(config=synth_config, text=text)
+            stream = client.SynthesizeStream(request)
+            if request_metrics is not None:
+                request_metrics.labels["source"] = "stream"
+                request_metrics.connected(stream)
+            audio = (response.audio for response in stream)
+        if cache is not None:
+            audio = cache.record(key, audio)
 
-    # Set up the synthesis stream
-    print("Creating TTS stream using voice '{}'".format(synth_config.voice_id))
-    request = lunapb.SynthesizeRequest(config=synth_config, text=text)
-    stream = client.SynthesizeStream(request)
-    offile = open("junk.raw", 'wb')
+    # Hand each chunk to the player, the file and the analyzer. On exit,
+    # the sinks catch up before the file is closed; if an error is
+    # already propagating, it is the one reported.
+    meter = None
+    try:
+        with contextlib.ExitStack() as stack:
+            sinks = [("player", player.push_audio)]
+            if raw_output_path is not None:
+                offile = stack.enter_context(open(raw_output_path, 'wb'))
+                sinks.append(("file", offile.write))
+            if analyze_audio:
+                meter = fanout.LevelMeter()
+                sinks.append(("analyzer", meter.write))
+            fan = stack.enter_context(fanout.FanOut(sinks, sink_queue_depth))
 
-    # Play responses as they come
-    first_response = True
-    for response in stream:
-        if first_response:
-            first_response = False
+            # Play responses as they come
+            first_response = True
+            for chunk in audio:
+                if first_response:
+                    first_response = False
 
-            # Display some statistics for the first response
-            time_to_first = time.time() - start_time
-            print("time to first samples: {:f} seconds".format(time_to_first))
+                    # Display some statistics for the first response
+                    time_to_first = time.monotonic() - start_time
+                    print("time to first samples: {:f} seconds".format(time_to_first))
 
-        player.push_audio(response.audio)
-        offile.write(response.audio)
+                if request_metrics is not None:
+                    request_metrics.chunk(len(chunk))
+                fan.write(chunk)
+    except Exception as err:
+        if request_metrics is not None:
+            request_metrics.finish(player.underruns - underruns, err)
+        raise
 
-    # Close the stream and stop the player application
-    player.stop()
-    offile.close()
+    # Wait for the utterance to finish playing
+    player.drain()
+    if request_metrics is not None:
+        request_metrics.finish(player.underruns - underruns)
 
     # Print how long the entire method took
-    total_time = time.time() - start_time
+    total_time = time.monotonic() - start_time
+    if synthesis is not None:
+        print("parallel synthesis speedup vs sequential segments: {:.2f}x (estimated from segment times)".format(
+            synthesis.speedup()))
+    print(fan.summary())
+    if meter is not None:
+        print(meter.summary())
     print("streaming synthesis took {:f} seconds\n".format(total_time))
 
 
 if __name__ == "__main__":
-    # Create the client
-    client = LunaClient(service_address=server_address)
+    # Create the client, using the shared channel pool, and start
+    # connecting to the server in the background
+    client = channels.client(server_address)
+    channels.pool.warmup(wait=False)
+
+    # Look up server info in the catalog cache
+    server_info = catalog.Catalog(ttl=catalog_ttl)
+    if refresh_catalog:
+        server_info.invalidate(server_address)
 
     # Print version info
-    version = client.Version().version
+    version = server_info.get(server_address, "version", lunapb.VersionResponse,
+                              client.Version).version
     print(version)
     print("")
 
     # Print the list of available voice models on the server
-    resp = client.ListVoices()
+    resp = server_info.get(server_address, "voices", lunapb.ListVoicesResponse,
+                           client.ListVoices)
     print("Available Models:")
     for v in resp.voices:
         print("  ID:", v.id)
@@ -96,11 +220,30 @@ if __name__ == "__main__":
         encoding=lunapb.SynthesizerConfig.RAW_LINEAR16
     )
 
+    # Set up the synthesis cache
+    cache = None
+    if tts_cache_dir is not None:
+        cache = tts_cache.TTSCache(tts_cache_dir, tts_cache_max_bytes)
+
+    # Set up the player, which stays open between utterances
+    player = audio_io.PlaybackSink(
+        sample_rate=play_sample_rate, prebuffer_ms=prebuffer_ms,
+        output=audio_io.playback_backend(playback_target, play_cmd))
+
+    # Set up the metrics recorder, using the voice's sample rate to
+    # compute audio durations
+    sample_rate = play_sample_rate
+    for v in resp.voices:
+        if v.id == voice_id:
+            sample_rate = v.sample_rate
+    recorder = metrics.Recorder(sample_rate, jsonl_path=metrics_jsonl,
+                                prometheus_path=metrics_prometheus)
+
     # Run the main loop
     try:
         while True:
             text = input("Luna> ")
-            stream_synthesis(text, client, cfg)
+            stream_synthesis(text, client, cfg, player, cache, recorder)
 
     except KeyboardInterrupt:
         # Stop when ctrl+C pressed
@@ -111,4 +254,9 @@ if __name__ == "__main__":
     except Exception as err:
         print("Synthesis error:", err)
 
+    player.close()
     print("")
+    print("playback underruns:", player.underruns)
+    if cache is not None:
+        print(cache.summary())
+    print(recorder.summary())
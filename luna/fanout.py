@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import queue
+import threading
+import time
+
+
+class Consumer(object):
+    """Consumer feeds the audio written to a FanOut to a single sink
+    (any callable that accepts a bytes-like object) from its own thread,
+    through a bounded queue. It records how far the sink falls behind."""
+
+    def __init__(self, name, write, depth):
+        self.name = name
+        self._write = write
+        self._queue = queue.Queue(maxsize=depth)
+        self.error = None
+
+        # Lag statistics
+        self.chunks = 0
+        self.queued_bytes = 0
+        self.max_queued_bytes = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.stalled = 0.0
+
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, view):
+        with self._lock:
+            self.queued_bytes += len(view)
+            self.max_queued_bytes = max(self.max_queued_bytes,
+                                        self.queued_bytes)
+        item = (time.monotonic(), view)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # The sink is depth chunks behind; wait for it rather than
+            # losing audio, and count the time the producer was held up
+            start = time.monotonic()
+            self._queue.put(item)
+            self.stalled += time.monotonic() - start
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued, view = item
+            if self.error is None:
+                try:
+                    self._write(view)
+                except Exception as err:
+                    # Keep draining the queue so the producer never
+                    # blocks on a sink that has failed
+                    self.error = err
+            lag = time.monotonic() - queued
+            with self._lock:
+                self.queued_bytes -= len(view)
+                self.chunks += 1
+                self.max_lag = max(self.max_lag, lag)
+                self.total_lag += lag
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def summary(self):
+        mean = self.total_lag / self.chunks if self.chunks else 0.0
+        text = "{}: {} chunks, lag mean {:.1f} ms max {:.1f} ms, " \
+               "max queued {} bytes, producer stalled {:.1f} ms".format(
+                   self.name, self.chunks, mean * 1000, self.max_lag * 1000,
+                   self.max_queued_bytes, self.stalled * 1000)
+        if self.error is not None:
+            text += ", failed: {}".format(self.error)
+        return text
+
+
+class FanOut(object):
+    """FanOut hands each received audio buffer to several sinks, such as
+    the player, a file and an analyzer, without copying it: every sink
+    is given a memoryview of the same buffer. Each sink is fed from its
+    own thread through a queue of at most depth chunks, so a slow disk or
+    pipe doesn't delay the receipt of the next message unless it falls
+    that far behind. Sinks must not modify the buffers they are given.
+    FanOut is a context manager that closes itself on exit."""
+
+    def __init__(self, sinks, depth=32):
+        self.consumers = [Consumer(name, write, depth)
+                          for name, write in sinks]
+
+    def write(self, chunk):
+        """Queues the chunk for every sink."""
+        view = memoryview(chunk)
+        for c in self.consumers:
+            c.put(view)
+
+    def close(self):
+        """Waits for every sink to consume its queued audio and stops the
+        consumer threads. Raises the first error raised by a sink."""
+        for c in self.consumers:
+            c.close()
+        for c in self.consumers:
+            if c.error is not None:
+                raise c.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # An error is already propagating; stop the consumers without
+        # raising a sink error that would hide it
+        for c in self.consumers:
+            c.close()
+
+    def summary(self):
+        """Returns the per-sink lag report."""
+        return "\n".join(c.summary() for c in self.consumers)
+
+
+class LevelMeter(object):
+    """LevelMeter is an example analyzer sink that measures the peak and
+    RMS level of 16-bit little-endian audio, in dBFS."""
+
+    def __init__(self):
+        self.peak = 0
+        self.samples = 0
+        self._sum_squares = 0
+        self._carry = b""
+
+    def write(self, data):
+        if self._carry:
+            data = self._carry + bytes(data)
+        even = len(data) - len(data) % 2
+        self._carry = bytes(data[even:])
+        samples = memoryview(data)[:even].cast("h")
+        if len(samples) == 0:
+            return
+        self.peak = max(self.peak, max(samples), -min(samples))
+        self._sum_squares += sum(s * s for s in samples)
+        self.samples += len(samples)
+
+    def summary(self):
+        if self.samples == 0 or self.peak == 0:
+            return "level: silent"
+        rms = math.sqrt(self._sum_squares / float(self.samples))
+        return "level: peak {:.1f} dBFS, RMS {:.1f} dBFS".format(
+            20 * math.log10(self.peak / 32768.0),
+            20 * math.log10(max(rms, 1.0) / 32768.0))
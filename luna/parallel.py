@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import queue
+import re
+import threading
+import time
+
+from luna import luna_pb2 as lunapb
+
+# Sentence and clause boundaries: punctuation followed by whitespace
+_sentence_end = re.compile(r"(?<=[.!?])\s+")
+_clause_end = re.compile(r"(?<=[,;:])\s+")
+
+
+def split_text(text, max_chars=200):
+    """Splits text into segments that can be synthesized independently.
+    The text is split at sentence boundaries, and sentences longer than
+    max_chars are split further at clause boundaries, then at spaces.
+    Short neighbouring pieces of a long sentence are joined again up to
+    max_chars, so the number of segments stays small."""
+    segments = []
+    for sentence in _sentence_end.split(text.strip()):
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            segments.append(sentence)
+            continue
+
+        pieces = []
+        for clause in _clause_end.split(sentence):
+            if len(clause) <= max_chars:
+                pieces.append(clause)
+            else:
+                pieces.extend(clause.split())
+
+        current = ""
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                segments.append(current)
+                current = piece
+            else:
+                current = piece if not current else current + " " + piece
+        if current:
+            segments.append(current)
+    return segments
+
+
+class ParallelSynthesis(object):
+    """ParallelSynthesis synthesizes text segments with concurrent
+    SynthesizeStream calls, at most max_workers at a time, and yields
+    their audio in order when iterated. Audio of the first segment is
+    yielded as it arrives; audio of later segments is buffered until all
+    earlier segments are done.
+
+    If iteration stops early, or close() is called, the streams that are
+    still running are cancelled and segments that haven't started are
+    skipped, so no more audio is synthesized or buffered.
+
+    After iteration, speedup() estimates how much faster this was than
+    synthesizing the same segments one after the other (the sum of the
+    segment synthesis times divided by the elapsed time). This is not a
+    comparison with a single request for the whole text, which isn't
+    made."""
+
+    def __init__(self, client, config, segments, max_workers=4):
+        self.segments = segments
+        self.segment_times = [0.0] * len(segments)
+        self.elapsed = None
+        self._client = client
+        self._config = config
+        self._queues = [queue.Queue() for _ in segments]
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._closed = False
+        self._start = time.monotonic()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+        self._futures = [self._executor.submit(self._run, i)
+                         for i in range(len(segments))]
+
+    def _run(self, i):
+        out = self._queues[i]
+        start = time.monotonic()
+        try:
+            request = lunapb.SynthesizeRequest(config=self._config,
+                                               text=self.segments[i])
+            with self._lock:
+                if self._closed:
+                    return
+                call = self._client.SynthesizeStream(request)
+                self._calls[i] = call
+            for response in call:
+                if self._closed:
+                    break
+                out.put(response.audio)
+        except Exception as err:
+            if not self._closed:
+                out.put(err)
+        finally:
+            with self._lock:
+                self._calls.pop(i, None)
+            self.segment_times[i] = time.monotonic() - start
+            out.put(None)
+
+    def __iter__(self):
+        try:
+            for q in self._queues:
+                while True:
+                    item = q.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            self.elapsed = time.monotonic() - self._start
+        finally:
+            self.close()
+
+    def close(self):
+        """Cancels the streams that are still running and skips the
+        segments that haven't started."""
+        with self._lock:
+            self._closed = True
+            calls = list(self._calls.values())
+        for call in calls:
+            # gRPC calls can be cancelled; streams without cancel() stop
+            # at their next chunk
+            cancel = getattr(call, "cancel", None)
+            if cancel is not None:
+                cancel()
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def speedup(self):
+        """Returns the estimated speedup over synthesizing the segments
+        one after the other."""
+        if not self.elapsed:
+            return 1.0
+        return sum(self.segment_times) / self.elapsed
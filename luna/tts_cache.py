@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright(2021) Cobalt Speech and Language Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License")
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http: // www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import unicodedata
+
+
+def normalize_text(text):
+    """Returns the text in the form used for cache keys: Unicode NFC
+    normalized, with runs of whitespace collapsed to a single space and
+    leading and trailing whitespace removed. Case and punctuation are
+    kept, since they can change how the text is spoken."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(voice_id, encoding, text):
+    """Returns the cache key for the given text synthesized with the given
+    voice and audio encoding."""
+    h = hashlib.sha256()
+    for part in (voice_id, encoding, normalize_text(text)):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class TTSCache(object):
+    """TTSCache is an on-disk, size-bounded LRU cache of synthesized audio.
+    Each entry is stored as raw audio in its own file named by its key,
+    and file modification times record recency so the LRU order survives
+    restarts. Cached audio is streamed straight from a memory map, so
+    playback of a hit can start immediately. It is safe to use from
+    multiple threads."""
+
+    def __init__(self, directory, max_bytes, chunk_size=8192):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+
+        # Load existing entries, least recently used first
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stream(self, key):
+        """Returns an iterator over the cached audio for the given key in
+        chunks of chunk_size bytes, or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            f = open(self._path(key), "rb")
+            os.utime(self._path(key))
+        except OSError:
+            # Removed from under us; treat it as a miss
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return self._read(f)
+
+    def count_miss(self):
+        """Counts a miss for a lookup made without stream(), e.g. when the
+        audio was prefetched because the key wasn't in the cache."""
+        with self._lock:
+            self.misses += 1
+
+    def _read(self, f):
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for start in range(0, size, self.chunk_size):
+                    chunk = m[start:start + self.chunk_size]
+                    with self._lock:
+                        self.bytes_saved += len(chunk)
+                    yield chunk
+
+    def record(self, key, chunks):
+        """Yields the given audio chunks while storing them under the given
+        key. The entry is only stored if all of the chunks are consumed
+        without error, so an interrupted synthesis is never cached."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        if size > self.max_bytes:
+            os.unlink(tmp)
+            return
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        # Must be called with the lock held
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def total_bytes(self):
+        """Returns the number of bytes currently stored in the cache."""
+        with self._lock:
+            return self._total_bytes
+
+    def hit_ratio(self):
+        """Returns the fraction of lookups that were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        """Returns a human readable summary of the cache statistics."""
+        return "TTS cache: {} hits, {} misses ({:.1%} hit ratio), {} bytes saved, {} evictions, {} bytes stored".format(
+            self.hits, self.misses, self.hit_ratio(), self.bytes_saved,
+            self.evictions, self.total_bytes())